@@ -10,15 +10,62 @@ CREATE TABLE public.meals (
     id SERIAL PRIMARY KEY,
     meal_number INTEGER,
     name VARCHAR,
-    date DATE
+    date DATE,
+    portions INTEGER
 );
+
+-- Menu calendar reads meals by date range.
+CREATE INDEX ix_meals_date ON public.meals (date);
 CREATE TABLE public.orders (
     id SERIAL PRIMARY KEY,
     user_id INTEGER NOT NULL,
     meal_id INTEGER NOT NULL,
     status BOOLEAN,
     withdrawed_at TIMESTAMP WITHOUT TIME ZONE,
+    updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
 
 CONSTRAINT fk_user FOREIGN KEY(user_id) REFERENCES public.users(id) ON DELETE CASCADE,
 CONSTRAINT fk_meal FOREIGN KEY(meal_id) REFERENCES public.meals(id) ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+-- Incremental analytics export reads orders changed since its watermark.
+CREATE INDEX ix_orders_updated_at ON public.orders (updated_at);
+
+-- Remaining portions of a meal, split into shards so concurrent orders don't queue on one row lock.
+CREATE TABLE public.meal_portions (
+    meal_id INTEGER NOT NULL,
+    shard INTEGER NOT NULL,
+    remaining INTEGER NOT NULL,
+
+CONSTRAINT pk_meal_portions PRIMARY KEY(meal_id, shard),
+CONSTRAINT ck_meal_portions_remaining CHECK (remaining >= 0),
+CONSTRAINT fk_portions_meal FOREIGN KEY(meal_id) REFERENCES public.meals(id) ON DELETE CASCADE
+);
+
+-- Orders of closed school years, moved out of public.orders by the archival job.
+CREATE TABLE public.orders_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    meal_id INTEGER NOT NULL,
+    status BOOLEAN,
+    withdrawed_at TIMESTAMP WITHOUT TIME ZONE,
+    archived_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+
+CONSTRAINT fk_archive_user FOREIGN KEY(user_id) REFERENCES public.users(id) ON DELETE CASCADE,
+CONSTRAINT fk_archive_meal FOREIGN KEY(meal_id) REFERENCES public.meals(id) ON DELETE CASCADE
+);
+
+-- Diacritic-insensitive prefix and fuzzy user search (/users/search).
+CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public;
+CREATE EXTENSION IF NOT EXISTS unaccent SCHEMA public;
+
+CREATE OR REPLACE FUNCTION public.f_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+
+CREATE INDEX ix_users_search_trgm ON public.users
+    USING gin (public.f_unaccent(lower(name || ' ' || surname)) public.gin_trgm_ops);
+
+-- Per-user order history (/users/{user_number}/orders): a user's current and archived orders, meals by primary key.
+CREATE INDEX ix_orders_user_meal ON public.orders (user_id, meal_id) INCLUDE (id, status, withdrawed_at);
+CREATE INDEX ix_orders_archive_user_meal ON public.orders_archive (user_id, meal_id);
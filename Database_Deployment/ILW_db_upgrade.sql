@@ -0,0 +1,53 @@
+-- Upgrades a database created by an older ILW_db_creation.sql to the current schema.
+-- Every statement is idempotent, so the script can be run again and on every tenant database.
+
+-- Orders of closed school years, moved out of public.orders by the archival job.
+CREATE TABLE IF NOT EXISTS public.orders_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    meal_id INTEGER NOT NULL,
+    status BOOLEAN,
+    withdrawed_at TIMESTAMP WITHOUT TIME ZONE,
+    archived_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+
+CONSTRAINT fk_archive_user FOREIGN KEY(user_id) REFERENCES public.users(id) ON DELETE CASCADE,
+CONSTRAINT fk_archive_meal FOREIGN KEY(meal_id) REFERENCES public.meals(id) ON DELETE CASCADE
+);
+
+-- Portion capacity of a meal, NULL means orders are not limited.
+ALTER TABLE public.meals ADD COLUMN IF NOT EXISTS portions INTEGER;
+
+-- Remaining portions of a meal, split into shards so concurrent orders don't queue on one row lock.
+CREATE TABLE IF NOT EXISTS public.meal_portions (
+    meal_id INTEGER NOT NULL,
+    shard INTEGER NOT NULL,
+    remaining INTEGER NOT NULL,
+
+CONSTRAINT pk_meal_portions PRIMARY KEY(meal_id, shard),
+CONSTRAINT ck_meal_portions_remaining CHECK (remaining >= 0),
+CONSTRAINT fk_portions_meal FOREIGN KEY(meal_id) REFERENCES public.meals(id) ON DELETE CASCADE
+);
+
+-- Last change of an order, read by the incremental analytics export. Existing rows are
+-- backfilled with the time of the upgrade, so the next export picks all of them up once.
+ALTER TABLE public.orders ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS ix_orders_updated_at ON public.orders (updated_at);
+
+-- Diacritic-insensitive prefix and fuzzy user search (/users/search). The application
+-- does not create these objects itself; run as a role allowed to create extensions.
+CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public;
+CREATE EXTENSION IF NOT EXISTS unaccent SCHEMA public;
+-- unaccent() is only STABLE, an index expression needs an IMMUTABLE function
+CREATE OR REPLACE FUNCTION public.f_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+CREATE INDEX IF NOT EXISTS ix_users_search_trgm ON public.users
+    USING gin (public.f_unaccent(lower(name || ' ' || surname)) public.gin_trgm_ops);
+
+-- Per-user order history (/users/{user_number}/orders), current and archived orders.
+-- Meals are read by primary key; the covering index of earlier versions only duplicated it.
+CREATE INDEX IF NOT EXISTS ix_orders_user_meal ON public.orders (user_id, meal_id) INCLUDE (id, status, withdrawed_at);
+CREATE INDEX IF NOT EXISTS ix_orders_archive_user_meal ON public.orders_archive (user_id, meal_id);
+DROP INDEX IF EXISTS public.ix_meals_id_date;
+-- Menu calendar (/meals/calendar) reads meals by date range.
+CREATE INDEX IF NOT EXISTS ix_meals_date ON public.meals (date);
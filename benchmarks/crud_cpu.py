@@ -0,0 +1,100 @@
+"""
+Micro-benchmark of per-call CPU time of the hot crud functions.
+
+Runs against an in-memory SQLite database seeded with synthetic data, so the
+numbers show the Python-side cost (statement construction, compilation cache
+lookup, ORM hydration) rather than database latency::
+
+    python benchmarks/crud_cpu.py [--calls 5000]
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "src")]
+
+os.environ.setdefault("NEONDB_STRING", "sqlite://")
+for name in ("AUTH0_DOMAIN", "AUTH0_API_AUDIENCE", "AUTH0_ISSUER", "AUTH0_ALGORITHMS"):
+    os.environ.setdefault(name, "benchmark")
+
+import crud
+import statements
+from db.database import SessionLocal, engine
+from db.models import Base, User, Meal, Order
+
+
+def seed(db, users: int) -> None:
+    """Creates users with one order for today's meal each."""
+    today = datetime.date.today()
+    meals = [Meal(meal_number=n, name=f"Meal {n}", date=today) for n in (1, 2, 3)]
+    db.add_all(meals)
+    db.flush()
+    for i in range(users):
+        user = User(name=f"Name{i}", surname=f"Surname{i}", ISIC_id=f"ISIC{i}", user_number=i, password="x")
+        db.add(user)
+        db.flush()
+        db.add(Order(user_id=user.id, meal_id=meals[i % 3].id, status=True, withdrawed_at=datetime.datetime.now()))
+    db.commit()
+
+
+def adhoc_user_meal_info(db, isic_id: str):
+    """The scan lookup as it was written before, rebuilding both queries on every call."""
+    today = datetime.date.today()
+    user = db.query(User).filter(User.ISIC_id == isic_id).first()
+    return (
+        db.query(
+            Meal.id.label("meal_id"), User.id.label("user_id"), Order.status.label("order_status"),
+            User.name.label("user_name"), Meal.meal_number.label("meal_number"), Meal.name.label("meal_name"),
+            User.user_number.label("user_number"), Meal.date.label("meal_date")
+        )
+        .join(Order, Order.user_id == User.id)
+        .join(Meal, Order.meal_id == Meal.id)
+        .filter(Order.user_id == user.id, Meal.date == today)
+        .first()
+    )
+
+
+def measure(label: str, call, calls: int) -> None:
+    """Prints the average CPU time of `call` in microseconds."""
+    for i in range(min(calls, 100)):
+        call(i)
+    start = time.process_time()
+    for i in range(calls):
+        call(i)
+    per_call = (time.process_time() - start) / calls * 1e6
+    print(f"{label:<40} {per_call:10.1f} us/call")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure per-call CPU of hot crud functions.")
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine.echo = False
+    statements.instrument_engine(engine)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    seed(db, args.users)
+
+    # expire_all keeps the identity map from answering lookups without hydrating rows
+    def run(func):
+        def call(i):
+            db.expire_all()
+            func(i % args.users)
+        return call
+
+    measure("get_user_by_number", run(lambda i: crud.get_user_by_number(db, i)), args.calls)
+    measure("get_meal_by_id", run(lambda i: crud.get_meal_by_id(db, i % 3 + 1)), args.calls)
+    measure("get_order_by_id", run(lambda i: crud.get_order_by_id(db, i + 1)), args.calls)
+    measure("get_user_meal_info", run(lambda i: crud.get_user_meal_info(db, f"ISIC{i}")), args.calls)
+    measure("get_user_meal_info (rebuilt queries)", run(lambda i: adhoc_user_meal_info(db, f"ISIC{i}")), args.calls)
+    print(statements.get_cache_stats())
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
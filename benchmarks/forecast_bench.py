@@ -0,0 +1,101 @@
+"""
+Benchmark of the demand forecast over a synthetic order history.
+
+Generates several school years of meals (three per school day) and orders in a
+SQLite database (or ``BENCH_DB_STRING``), then times loading the history and computing the forecast, and
+separately the vectorized computation on arrays of many more meals::
+
+    python benchmarks/forecast_bench.py --years 5 --orders-per-meal 150
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "src")]
+
+# Never the configured application database, the tables are dropped and recreated
+os.environ["NEONDB_STRING"] = os.environ.get("BENCH_DB_STRING", "sqlite:///forecast_bench.db")
+for name in ("AUTH0_DOMAIN", "AUTH0_API_AUDIENCE", "AUTH0_ISSUER", "AUTH0_ALGORITHMS"):
+    os.environ.setdefault(name, "benchmark")
+
+import numpy as np
+from sqlalchemy import insert
+import forecast
+from db.database import SessionLocal, engine
+from db.models import Base, User, Meal, Order
+
+
+def seed(db, years: int, orders_per_meal: int) -> int:
+    """Creates meals for every weekday of `years` years and orders for them, returns the number of orders."""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db.execute(insert(User), [
+        {"name": f"N{i}", "surname": "S", "ISIC_id": str(i), "user_number": i, "password": "x"}
+        for i in range(orders_per_meal * 2)
+    ])
+
+    today = datetime.date.today()
+    days = [today - datetime.timedelta(days=d) for d in range(1, years * 365)]
+    meals = [
+        {"meal_number": n, "name": f"Meal {n}", "date": day}
+        for day in days if day.weekday() < 5 for n in (1, 2, 3)
+    ]
+    db.execute(insert(Meal), meals)
+
+    rng = random.Random(1)
+    orders = []
+    for meal_id, meal in enumerate(meals, start=1):
+        count = max(int(rng.gauss(orders_per_meal * (1.2 if meal["meal_number"] == 1 else 0.9), 15)), 0)
+        picked = datetime.datetime.combine(meal["date"], datetime.time(12))
+        orders.extend(
+            {"user_id": u + 1, "meal_id": meal_id, "status": True, "withdrawed_at": picked if rng.random() < 0.93 else None}
+            for u in range(count)
+        )
+    for start in range(0, len(orders), 50000):
+        db.execute(insert(Order), orders[start:start + 50000])
+    db.commit()
+    return len(orders)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time the demand forecast over a synthetic history.")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--orders-per-meal", type=int, default=150)
+    parser.add_argument("--synthetic-meals", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    engine.echo = False
+    db = SessionLocal()
+    print(f"seeding {args.years} years ...")
+    orders = seed(db, args.years, args.orders_per_meal)
+
+    start = time.perf_counter()
+    history = forecast.load_history(db)
+    loaded = time.perf_counter()
+    forecast.compute_forecast(history, datetime.date.today(), 28)
+    computed = time.perf_counter()
+    print(f"{orders} orders, {len(history['date'])} meals")
+    print(f"load_history:     {(loaded - start) * 1000:8.1f} ms")
+    print(f"compute_forecast: {(computed - loaded) * 1000:8.1f} ms")
+
+    # Only the vectorized part, on far more meals than any canteen has
+    rng = np.random.default_rng(1)
+    today = np.datetime64(datetime.date.today(), "D")
+    synthetic = {
+        "date": today - rng.integers(1, 3650, args.synthetic_meals).astype("timedelta64[D]"),
+        "meal_number": rng.integers(1, 4, args.synthetic_meals),
+        "ordered": rng.poisson(150, args.synthetic_meals).astype(np.float64),
+        "withdrawn": rng.poisson(140, args.synthetic_meals).astype(np.float64),
+    }
+    start = time.perf_counter()
+    forecast.compute_forecast(synthetic, datetime.date.today(), 28)
+    print(f"compute_forecast over {args.synthetic_meals} meals: {(time.perf_counter() - start) * 1000:.1f} ms")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Concurrency check of portion reservation: fires many simultaneous orders at one meal.
+
+Creates a meal for today with a limited number of portions and more users than
+portions, then places one order per user from a thread pool, each with its own
+session. Reports how many orders got through, that no portion was oversold, and
+the throughput. Finally moves accepted orders to a second meal with one portion and
+checks that the move takes that portion and gives the old one back.
+
+The benchmark never touches the database of ``NEONDB_STRING``: it runs against
+``BENCH_DB_STRING`` (a local SQLite file by default) and only deletes its own
+``Bench*`` users and meals and their orders. Point ``BENCH_DB_STRING`` at a scratch
+Postgres database to measure real row-lock contention::
+
+    BENCH_DB_STRING=postgresql://localhost/ilw_bench python benchmarks/portions_contention.py --portions 100 --orders 500
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "src")]
+
+# Never the configured application database, setup() deletes rows
+os.environ["NEONDB_STRING"] = os.environ.get("BENCH_DB_STRING", "sqlite:///portions_bench.db")
+for name in ("AUTH0_DOMAIN", "AUTH0_API_AUDIENCE", "AUTH0_ISSUER", "AUTH0_ALGORITHMS"):
+    os.environ.setdefault(name, "benchmark")
+
+from fastapi import HTTPException
+import crud
+from db.database import SessionLocal, engine
+from db.models import Base, User, Meal, Order
+from schemas import MealCreate, OrderCreate, OrderPatch
+
+
+def setup(portions: int, orders: int) -> int:
+    """Creates a meal for today with `portions` portions and `orders` users, returns the meal ID."""
+    db = SessionLocal()
+    today = datetime.date.today()
+    bench_meals = db.query(Meal.id).filter(Meal.name.like("Bench%"))
+    bench_users = db.query(User.id).filter(User.name.like("Bench%"))
+    db.query(Order).filter(Order.meal_id.in_(bench_meals) | Order.user_id.in_(bench_users)).delete(synchronize_session=False)
+    db.query(Meal).filter(Meal.name.like("Bench%")).delete(synchronize_session=False)
+    db.query(User).filter(User.name.like("Bench%")).delete(synchronize_session=False)
+    db.add_all([
+        User(name=f"Bench{i}", surname="Contention", ISIC_id=f"BENCH{i}", user_number=900000 + i, password="x")
+        for i in range(orders)
+    ])
+    db.commit()
+    meal = crud.create_meal(db, MealCreate(meal_number=1, name="Bench meal", date=today, portions=portions))
+    db.close()
+    return meal.id
+
+
+def place_order(i: int) -> bool:
+    """Places one order, returns whether a portion was left."""
+    db = SessionLocal()
+    try:
+        crud.create_order(db, OrderCreate(name=f"Bench{i}", surname="Contention", meal_number=1, status=True))
+        return True
+    except HTTPException as error:
+        if error.status_code == 409:
+            return False
+        raise
+    finally:
+        db.close()
+
+
+def check_move(meal_id: int) -> bool:
+    """Moves two accepted orders to a new meal with one portion, returns whether the portions add up."""
+    db = SessionLocal()
+    try:
+        other = crud.create_meal(db, MealCreate(meal_number=2, name="Bench move", date=datetime.date.today(), portions=1))
+        movers = db.query(User.user_number).join(Order, Order.user_id == User.id).filter(Order.meal_id == meal_id).limit(2).all()
+        before = crud.get_remaining_portions(db, meal_id)
+        crud.patch_order(db, movers[0].user_number, OrderPatch(meal_id=other.id))
+        try:
+            crud.patch_order(db, movers[1].user_number, OrderPatch(meal_id=other.id))
+            refused = False
+        except HTTPException as error:
+            refused = error.status_code == 409
+        moved = db.query(Order).filter(Order.meal_id == other.id).count()
+        print(f"move to sold out:   {'409' if refused else 'accepted'}, {moved} order(s) moved")
+        return (
+            refused and moved == 1
+            and crud.get_remaining_portions(db, other.id) == 0
+            and crud.get_remaining_portions(db, meal_id) == before + 1
+        )
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fire simultaneous orders at one meal with limited portions.")
+    parser.add_argument("--portions", type=int, default=100)
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+
+    engine.echo = False
+    Base.metadata.create_all(bind=engine)
+    meal_id = setup(args.portions, args.orders)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(place_order, range(args.orders)))
+    elapsed = time.perf_counter() - start
+
+    db = SessionLocal()
+    stored = db.query(Order).filter(Order.meal_id == meal_id).count()
+    remaining = crud.get_remaining_portions(db, meal_id)
+    db.close()
+
+    accepted = sum(results)
+    print(f"orders placed:      {args.orders} ({args.workers} concurrent)")
+    print(f"accepted:           {accepted}")
+    print(f"sold out (409):     {args.orders - accepted}")
+    print(f"orders stored:      {stored}")
+    print(f"portions remaining: {remaining}")
+    print(f"throughput:         {args.orders / elapsed:.0f} orders/s")
+
+    expected = min(args.portions, args.orders)
+    if accepted != expected or stored != expected or remaining != args.portions - expected:
+        sys.exit(f"FAILED: expected {expected} accepted orders and {args.portions - expected} remaining portions")
+    if not check_move(meal_id):
+        sys.exit("FAILED: moving an order to another meal did not move its portion")
+    print("OK: no portion oversold")
+
+
+if __name__ == '__main__':
+    main()
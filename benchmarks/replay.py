@@ -0,0 +1,160 @@
+"""
+Replays captured traffic against a running instance and reports latency per route.
+
+Reads a capture written by ``src/capture.py``, keeps the original request timing
+compressed by ``--speed`` and prints latency percentiles per route next to the
+latencies measured at capture time. Run it against a local instance whose database
+holds users, e.g. a copy of production or a seeded one, so that captured requests
+find data::
+
+    python benchmarks/replay.py capture.jsonl --url http://127.0.0.1:8000 --speed 20 --day 2025-03-14
+
+Pseudonyms from the capture are mapped to users of the target instance (listed by
+``GET /users/private``): every pseudonym always maps to the same user, so repeated
+scans of one student stay repeated. Within one JSON object all identifying fields
+come from the same user, so e.g. an order body names an existing user. Writes are
+replayed too unless ``--methods GET`` is given.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import statistics
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+USER_FIELDS = {
+    "ISIC_id": "ISIC_id", "ISIC_ids": "ISIC_id", "user_number": "user_number", "user_numbers": "user_number",
+    "name": "name", "surname": "surname", "password": "password", "q": "surname",
+}
+
+
+def load_capture(path: str, day: Optional[str], methods: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """Reads the captured requests, optionally only of one day and some methods, ordered by time."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if day and datetime.date.fromtimestamp(record["t"]).isoformat() != day:
+                continue
+            if methods and record["m"] not in methods:
+                continue
+            records.append(record)
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+class PseudonymMap:
+    """Maps capture pseudonyms to users of the target instance."""
+
+    def __init__(self, users: List[Dict[str, Any]]):
+        if not users:
+            raise SystemExit("the target instance has no users to map the capture to")
+        self.users = users
+
+    def user(self, value: str) -> Dict[str, Any]:
+        return self.users[int(value[1:], 16) % len(self.users)]
+
+    def resolve(self, data: Any, field: Optional[str] = None, user: Optional[Dict[str, Any]] = None) -> Any:
+        """Replaces pseudonyms in path parameters, query parameters or a JSON body."""
+        if isinstance(data, dict):
+            # One user for all identifying fields of an object, picked by its first pseudonym
+            first = next((v for k, v in data.items() if k in USER_FIELDS and isinstance(v, str) and v.startswith("~")), None)
+            own = self.user(first) if first else user
+            return {key: self.resolve(value, key, own) for key, value in data.items()}
+        if isinstance(data, list):
+            return [self.resolve(value, field) for value in data]
+        if field in USER_FIELDS and isinstance(data, str) and data.startswith("~"):
+            value = (user or self.user(data))[USER_FIELDS[field]]
+            return value[:3] if field == "q" else value
+        return data
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[max(int(len(values) * q) - 1, 0)]
+
+
+async def replay(records: List[Dict[str, Any]], url: str, speed: float, token: str, concurrency: int) -> Dict[str, Any]:
+    """Sends the records at their captured offsets divided by `speed`, returns measurements per route."""
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"latencies": [], "captured": [], "errors": 0, "mismatched": 0})
+    lag = []
+
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=60) as http:
+        users = (await http.get("/users/private")).json()
+        mapping = PseudonymMap(users)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(record: Dict[str, Any]) -> None:
+            key = f"{record['m']} {record['r']}"
+            path = record["r"].format(**mapping.resolve(record.get("p", {})))
+            body = mapping.resolve(record["b"]) if "b" in record else None
+            result = results[key]
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await http.request(record["m"], path, params=mapping.resolve(record.get("q", {})), json=body)
+                except httpx.TransportError:
+                    result["errors"] += 1
+                    return
+                result["latencies"].append((time.perf_counter() - start) * 1000)
+            result["captured"].append(record["d"])
+            if response.status_code >= 500:
+                result["errors"] += 1
+            elif response.status_code != record["s"]:
+                result["mismatched"] += 1
+
+        tasks = []
+        t0 = records[0]["t"]
+        start = time.monotonic()
+        for record in records:
+            delay = (record["t"] - t0) / speed - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lag.append(-delay)
+            tasks.append(asyncio.create_task(send(record)))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+
+    return {"routes": results, "elapsed": elapsed, "max_lag": max(lag, default=0.0)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay captured traffic and report latency per route.")
+    parser.add_argument("capture", help="capture file written by src/capture.py")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay N times faster than captured")
+    parser.add_argument("--day", help="only replay requests of this day (YYYY-MM-DD)")
+    parser.add_argument("--methods", nargs="+", help="only replay these methods, e.g. GET")
+    parser.add_argument("--token", default="", help="bearer token for protected routes")
+    parser.add_argument("--concurrency", type=int, default=256, help="maximum requests in flight")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture, args.day, args.methods)
+    if not records:
+        raise SystemExit("no captured requests to replay")
+    span = records[-1]["t"] - records[0]["t"]
+    print(f"replaying {len(records)} requests spanning {span:.0f} s at {args.speed:g}x")
+    report = asyncio.run(replay(records, args.url, args.speed, args.token, args.concurrency))
+
+    print(f"done in {report['elapsed']:.1f} s, client fell behind schedule by at most {report['max_lag'] * 1000:.0f} ms")
+    print(f"{'route':<42} {'count':>6} {'err':>4} {'diff':>4} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'capt p50':>9}")
+    for key, result in sorted(report["routes"].items(), key=lambda item: -len(item[1]["latencies"])):
+        latencies = sorted(result["latencies"])
+        if not latencies:
+            print(f"{key:<42} {0:>6} {result['errors']:>4}")
+            continue
+        print(
+            f"{key:<42} {len(latencies):>6} {result['errors']:>4} {result['mismatched']:>4} "
+            f"{percentile(latencies, 0.5):>8.2f} {percentile(latencies, 0.9):>8.2f} "
+            f"{percentile(latencies, 0.99):>8.2f} {latencies[-1]:>8.2f} {statistics.median(result['captured']):>9.2f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Throughput of the production server with 1 to N worker processes.
+
+For each worker count the server is started through ``src/server.py`` and loaded by
+several client processes running keep-alive connections for a fixed time against
+one read endpoint. Requests per second and latency percentiles are printed per
+worker count. Use a database that can serve the load (``NEONDB_STRING``) and run
+the benchmark on a machine with at least as many cores as workers plus clients::
+
+    NEONDB_STRING=postgresql://localhost/ilw_bench python benchmarks/server_scaling.py --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    """Starts src/server.py with `workers` workers and waits until it answers."""
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([ROOT, SRC]),
+        SERVER_WORKERS=str(workers),
+        SERVER_PORT=str(port),
+        DB_ECHO="false",
+    )
+    env.setdefault("NEONDB_STRING", "sqlite:///" + os.path.join(ROOT, "scaling_bench.db"))
+    for name in ("AUTH0_DOMAIN", "AUTH0_API_AUDIENCE", "AUTH0_ISSUER", "AUTH0_ALGORITHMS"):
+        env.setdefault(name, "benchmark")
+
+    server = subprocess.Popen([sys.executable, "server.py"], cwd=SRC, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("server did not start")
+
+
+def seed(port: int) -> str:
+    """Creates a meal and returns the path that is requested during the benchmark."""
+    meal = httpx.post(f"http://127.0.0.1:{port}/meals/", json={
+        "meal_number": 1, "name": "Bench meal", "date": str(datetime.date.today())
+    }).json()
+    return f"/meals/{meal['id']}"
+
+
+async def client(url: str, connections: int, duration: float) -> list:
+    """Runs `connections` keep-alive loops for `duration` seconds, returns latencies."""
+    latencies = []
+    deadline = time.monotonic() + duration
+
+    async def loop(http: httpx.AsyncClient):
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            response = await http.get(url)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as http:
+        await asyncio.gather(*(loop(http) for _ in range(connections)))
+    return latencies
+
+
+def client_process(args) -> list:
+    """Entry point of one load generating process."""
+    return asyncio.run(client(*args))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure server throughput for several worker counts.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=4, help="load generating processes")
+    parser.add_argument("--connections", type=int, default=16, help="connections per client process")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for workers in args.workers:
+        server = start_server(workers, args.port)
+        try:
+            url = f"http://127.0.0.1:{args.port}" + seed(args.port)
+            with multiprocessing.Pool(args.clients) as pool:
+                results = pool.map(client_process, [(url, args.connections, args.duration)] * args.clients)
+        finally:
+            server.terminate()
+            server.wait()
+
+        latencies = sorted(l for result in results for l in result)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"{workers:>7} {len(latencies) / args.duration:>10.0f} "
+              f"{statistics.median(latencies) * 1000:>8.2f} {p99 * 1000:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Checks tenant routing against several local SQLite databases.
+
+Configures ``--tenants`` tenant databases and a default one in a temporary directory,
+with at most ``--max-engines`` engines open, then drives the application in process
+and verifies that:
+
+* every tenant only sees its own users, whether it is named by header or token claim,
+* the token claim takes precedence over the header, and a token without a claim
+  can't pick a tenant by header,
+* a non-string claim is rejected with 400 and an unknown tenant with 404,
+* a request naming no tenant uses the default database,
+* no more than ``--max-engines`` tenant engines are open at any time,
+* the tables of a tenant are created once, not again for an engine recreated after eviction.
+
+Exits with status 1 when a check fails::
+
+    python benchmarks/tenant_routing.py --tenants 4 --max-engines 2
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "src")]
+
+
+def configure(directory: str, tenants: int, max_engines: int) -> list:
+    """Points the settings at one SQLite file per tenant, returns the tenant names."""
+    names = [f"school{i}" for i in range(tenants)]
+    os.environ["NEONDB_STRING"] = "sqlite:///" + os.path.join(directory, "default.db")
+    os.environ["TENANT_DATABASES"] = json.dumps({
+        name: "sqlite:///" + os.path.join(directory, f"{name}.db") for name in names
+    })
+    os.environ["TENANT_MAX_ENGINES"] = str(max_engines)
+    os.environ["DB_ECHO"] = "false"
+    for name in ("AUTH0_DOMAIN", "AUTH0_API_AUDIENCE", "AUTH0_ISSUER", "AUTH0_ALGORITHMS"):
+        os.environ.setdefault(name, "benchmark")
+    return names
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Verify per-tenant database routing.")
+    parser.add_argument("--tenants", type=int, default=4)
+    parser.add_argument("--max-engines", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = configure(directory, args.tenants, args.max_engines)
+
+        import jwt
+        from fastapi.testclient import TestClient
+        import main as app_module
+        from db.database import tenant_engines
+
+        client = TestClient(app_module.app, raise_server_exceptions=False)
+        schema_setups = []
+        tenant_engines.schema_hooks.append(lambda engine: schema_setups.append(str(engine.url)))
+        failures = []
+        most_engines = 0
+
+        def check(condition: bool, message: str) -> None:
+            print(("ok    " if condition else "FAIL  ") + message)
+            if not condition:
+                failures.append(message)
+
+        def token(claim) -> dict:
+            encoded = jwt.encode({"tenant": claim}, "benchmark", algorithm="HS256")
+            return {"Authorization": f"Bearer {encoded}"}
+
+        # Two rounds, so engines evicted in the first round are created again
+        for round_number in range(2):
+            for index, name in enumerate(names):
+                user_number = round_number * 100 + index
+                response = client.post("/users/", headers={"X-Tenant": name}, json={
+                    "name": name, "surname": "Tenant", "ISIC_id": f"{name}-{round_number}",
+                    "user_number": user_number, "password": "x",
+                })
+                check(response.status_code == 200, f"create user in {name} (round {round_number})")
+                most_engines = max(most_engines, len(tenant_engines._engines))
+
+        for name in names:
+            by_header = {u["name"] for u in client.get("/users/private", headers={"X-Tenant": name}).json()}
+            check(by_header == {name}, f"{name} sees only its own users by header")
+            by_claim = {u["name"] for u in client.get("/users/private", headers=token(name)).json()}
+            check(by_claim == {name}, f"{name} sees only its own users by token claim")
+            most_engines = max(most_engines, len(tenant_engines._engines))
+
+        claimed = client.get("/users/private", headers={**token(names[0]), "X-Tenant": names[1]}).json()
+        check({u["name"] for u in claimed} == {names[0]}, "token claim takes precedence over header")
+        unclaimed = jwt.encode({"sub": "benchmark"}, "benchmark", algorithm="HS256")
+        check(
+            client.get("/users/private", headers={"Authorization": f"Bearer {unclaimed}", "X-Tenant": names[0]}).status_code == 403,
+            "token without claim can't pick a tenant by header"
+        )
+        check(client.get("/users/private", headers=token([names[0]])).status_code == 400, "list claim is rejected with 400")
+        check(client.get("/users/private", headers=token({"a": 1})).status_code == 400, "object claim is rejected with 400")
+        check(client.get("/users/private", headers={"X-Tenant": "nowhere"}).status_code == 404, "unknown tenant header gives 404")
+        check(client.get("/users/private", headers=token("nowhere")).status_code == 404, "unknown tenant claim gives 404")
+        check(client.get("/users/private").json() == [], "no tenant uses the empty default database")
+        check(most_engines <= args.max_engines, f"at most {args.max_engines} engines open (saw {most_engines})")
+        check(len(schema_setups) == len(set(schema_setups)) == len(names), f"tables created once per tenant (saw {len(schema_setups)})")
+
+        tenant_engines.dispose_all()
+        app_module.engine.dispose()
+
+    if failures:
+        print(f"{len(failures)} check(s) failed")
+        sys.exit(1)
+    print("all checks passed")
+
+
+if __name__ == '__main__':
+    main()
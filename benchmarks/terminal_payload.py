@@ -0,0 +1,76 @@
+"""
+Size and encoding cost of the scan and offline sync responses per format.
+
+Compares the generic JSON path (pydantic validation of the response model and the
+JSON encoder, as FastAPI does it) with the fixed-layout MessagePack and CBOR payloads
+of ``src/compact.py``, for one scan and for a sync of many scans::
+
+    python benchmarks/terminal_payload.py --batch 500
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "src")]
+
+os.environ.setdefault("NEONDB_STRING", "sqlite://")
+for name in ("AUTH0_DOMAIN", "AUTH0_API_AUDIENCE", "AUTH0_ISSUER", "AUTH0_ALGORITHMS"):
+    os.environ.setdefault(name, "benchmark")
+
+from typing import Any, Dict, List
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+import compact
+
+
+def meal_info(i: int) -> Dict[str, Any]:
+    return {
+        "meal_id": 4000 + i % 3, "user_id": 10000 + i, "order_status": True, "user_name": "Kateřina",
+        "user_number": 20240000 + i, "meal_number": 1 + i % 3, "meal_name": "Svíčková na smetaně, knedlík",
+        "meal_date": datetime.date.today(),
+    }
+
+
+def measure(label: str, value: Any, adapter: TypeAdapter, layout, repeat: int) -> None:
+    def generic() -> bytes:
+        return json.dumps(jsonable_encoder(adapter.validate_python(value)), ensure_ascii=False).encode()
+
+    rows = [("json", generic, lambda data: json.loads(data))]
+    for media_type in (compact.MSGPACK, compact.CBOR):
+        if media_type in compact._ENCODERS:
+            rows.append((
+                media_type.split("/")[1],
+                lambda media_type=media_type: compact.encode(media_type, layout(value)),
+                lambda data, media_type=media_type: compact.decode(media_type, data),
+            ))
+
+    print(label)
+    print(f"  {'format':<8} {'bytes':>8} {'encode us':>10} {'decode us':>10}")
+    for name, encoder, decoder in rows:
+        data = encoder()
+        encode_us = timeit.timeit(encoder, number=repeat) / repeat * 1e6
+        decode_us = timeit.timeit(lambda: decoder(data), number=repeat) / repeat * 1e6
+        print(f"  {name:<8} {len(data):>8} {encode_us:>10.1f} {decode_us:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare terminal response formats.")
+    parser.add_argument("--batch", type=int, default=500, help="scans in one offline sync")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    measure("scan", meal_info(0), TypeAdapter(Dict[str, Any]), compact.meal_info_payload, args.repeat * 10)
+    found = [{"ISIC_id": str(1000 + i), **meal_info(i)} for i in range(args.batch)]
+    not_found = [{"ISIC_id": str(i), "detail": compact.NO_MEAL_TODAY} for i in range(args.batch // 10)]
+    measure(
+        f"sync of {args.batch} scans", {"found": found, "not_found": not_found},
+        TypeAdapter(Dict[str, List[Dict[str, Any]]]), compact.batch_payload, args.repeat
+    )
+
+
+if __name__ == '__main__':
+    main()
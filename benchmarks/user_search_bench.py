@@ -0,0 +1,89 @@
+"""
+Benchmark of the user name search over many users.
+
+Seeds a Postgres database with Czech names and surnames (with diacritics), creates
+the trigram index and times prefix, diacritic-free and misspelled queries::
+
+    BENCH_DB_STRING=postgresql://... python benchmarks/user_search_bench.py --users 50000
+
+The trigram index only exists on Postgres; on other databases this times the
+unindexed development fallback. The tables are dropped and recreated, so the
+benchmark never uses ``NEONDB_STRING``, only ``BENCH_DB_STRING``.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "src")]
+
+os.environ["NEONDB_STRING"] = os.environ.get("BENCH_DB_STRING", "sqlite:///search_bench.db")
+for name in ("AUTH0_DOMAIN", "AUTH0_API_AUDIENCE", "AUTH0_ISSUER", "AUTH0_ALGORITHMS"):
+    os.environ.setdefault(name, "benchmark")
+
+from sqlalchemy import insert
+import crud
+from db.database import SessionLocal, engine
+from db.models import Base, User
+from search import ensure_search_index
+
+NAMES = ["Jiří", "Jan", "Tomáš", "Lukáš", "Matěj", "Šimon", "Tereza", "Kateřina", "Anežka", "Eliška", "Zuzana", "Ondřej"]
+SURNAMES = [
+    "Novák", "Svoboda", "Novotný", "Dvořák", "Černý", "Procházka", "Kučera", "Veselý", "Horák", "Němec",
+    "Pokorný", "Marek", "Pospíšil", "Hájek", "Jelínek", "Král", "Růžička", "Beneš", "Fiala", "Sedláček",
+]
+QUERIES = ["nov", "dvorak", "ruzic", "sedlacek", "prochazak", "Kateřina Č", "sim", "eliska hor", "jelinke"]
+
+
+def seed(db, users: int) -> None:
+    """Recreates the tables and inserts `users` users with random names."""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(1)
+    rows = [
+        {
+            "name": rng.choice(NAMES),
+            # Vary the surnames so the index has more than a handful of distinct values
+            "surname": rng.choice(SURNAMES) + ("" if i % 3 else f"-{rng.choice(SURNAMES)}"),
+            "ISIC_id": str(i), "user_number": i, "password": "x",
+        }
+        for i in range(users)
+    ]
+    for start in range(0, len(rows), 10000):
+        db.execute(insert(User), rows[start:start + 10000])
+    db.commit()
+    ensure_search_index(engine)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time the user name search.")
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    engine.echo = False
+    db = SessionLocal()
+    print(f"seeding {args.users} users on {engine.dialect.name} ...")
+    seed(db, args.users)
+
+    for query in QUERIES:
+        crud.search_users(db, query)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = crud.search_users(db, query)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        best = f"{results[0]['name']} {results[0]['surname']}" if results else "-"
+        print(
+            f"{query!r:14} p50 {statistics.median(timings):6.2f} ms  "
+            f"p99 {timings[int(len(timings) * 0.99) - 1]:6.2f} ms  top: {best}"
+        )
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 from functools import lru_cache
+from typing import Dict, Optional
+from pydantic import Field
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -8,6 +10,63 @@ class Settings(BaseSettings):
     auth0_algorithms: str
     neondb_string : str
 
+    # Opt-in request profiling, see src/profiling.py
+    profiling_sample_rate: float = 0.0
+    profiling_token: str = ""
+    profiling_interval: float = 0.001
+    profiling_max_profiles: int = 50
+
+    # Request tracing, see src/tracing.py ("", "memory" or "file")
+    tracing_exporter: str = ""
+    tracing_file: str = "traces.jsonl"
+
+    # Multi-canteen tenancy, see src/db/database.py
+    tenant_databases: Dict[str, str] = {}
+    tenant_header: str = "X-Tenant"
+    tenant_claim: str = "tenant"
+    tenant_max_engines: int = 16
+    tenant_engine_idle_seconds: float = 600
+
+    # Number of counter rows a meal's portion capacity is split into, see crud.reserve_portion
+    portion_shards: int = 8
+
+    # Production server, see src/server.py
+    server_host: str = "127.0.0.1"
+    server_port: int = 8000
+    server_workers: int = 1  # 0 starts one worker per CPU
+    server_loop: str = "auto"
+    server_http: str = "auto"
+    server_backlog: int = 2048
+    server_keep_alive: int = 5
+    server_graceful_timeout: int = 30
+    server_limit_concurrency: Optional[int] = None
+
+    # Database connections shared by all server workers of one database
+    db_max_connections: int = 20
+    db_pool_overflow_ratio: float = Field(default=0.25, ge=0, lt=1)
+    db_pool_timeout: float = 10
+    db_echo: bool = True
+
+    # Columnar analytics export, see src/analytics.py
+    analytics_export_dir: str = "exports/orders"
+    analytics_watermark_overlap_seconds: int = 300
+
+    # Demand forecast, see src/forecast.py
+    forecast_half_life_days: float = 28
+
+    # Per-route deadline budgets in seconds, see src/deadlines.py; keys like "GET /orders/"
+    default_route_timeout: float = 10
+    route_timeouts: Dict[str, float] = {}
+
+    # Weekly menu calendar cache, see src/menu.py
+    menu_cache_ttl_seconds: float = 60
+    menu_calendar_max_weeks: int = 8
+
+    # Opt-in traffic capture for replay benchmarks, see src/capture.py ("" = disabled)
+    capture_file: str = ""
+    capture_secret: str = ""  # Key of the pseudonyms, required with capture_file
+    capture_max_body: int = 65536
+
     class Config:
         env_file = ".env"
 
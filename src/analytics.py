@@ -0,0 +1,208 @@
+"""
+Columnar export of orders for long-term analytics.
+
+Orders joined with meal and user attributes are written as Parquet files
+partitioned by the month of the meal (``month=YYYY-MM``). Each run only exports
+orders created or changed since the previous run, tracked by a watermark on
+``orders.updated_at`` stored next to the data, and appends them as new files.
+A changed order is therefore stored in several versions; :func:`load_orders`
+keeps only the latest one. Deleted orders are not tracked.
+
+Requires the optional ``analytics`` dependency group (``poetry install --with analytics``).
+Meant to be run daily, e.g. from cron::
+
+    python analytics.py
+    python analytics.py --output exports/orders --tenant gymnazium
+"""
+import argparse
+import datetime
+import json
+import os
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from config import get_settings
+from db.models import User, Meal, Order
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+WATERMARK_FILE = "_watermark.json"
+
+ORDERS_SCHEMA = None if pa is None else pa.schema([
+    ("order_id", pa.int64()),
+    ("user_id", pa.int64()),
+    ("user_number", pa.int64()),
+    ("meal_id", pa.int64()),
+    ("meal_number", pa.int16()),
+    ("meal_name", pa.string()),
+    ("meal_date", pa.date32()),
+    ("status", pa.bool_()),
+    ("withdrawed_at", pa.timestamp("us")),
+    ("updated_at", pa.timestamp("us")),
+    ("exported_at", pa.timestamp("us")),
+])
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("The analytics export needs pyarrow, install it with 'poetry install --with analytics'.")
+
+
+def read_watermark(output: str) -> Optional[datetime.datetime]:
+    """
+    Read the ``updated_at`` of the newest order exported so far.
+
+    :param output: Export directory.
+    :type output: str
+    :return: The watermark, None before the first export.
+    :rtype: datetime.datetime | None
+    """
+    path = os.path.join(output, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return datetime.datetime.fromisoformat(json.load(f)["updated_at"])
+
+
+def write_watermark(output: str, watermark: datetime.datetime) -> None:
+    """
+    Store the ``updated_at`` of the newest exported order.
+
+    The file is replaced atomically so an interrupted run never leaves a broken watermark.
+
+    :param output: Export directory.
+    :type output: str
+    :param watermark: The new watermark.
+    :type watermark: datetime.datetime
+    """
+    path = os.path.join(output, WATERMARK_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"updated_at": watermark.isoformat()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def export_orders(db: Session, output: str) -> int:
+    """
+    Append orders created or changed since the last export to the Parquet dataset.
+
+    Orders changed up to ``Settings.analytics_watermark_overlap_seconds`` before the
+    watermark are exported again, so rows committed late by long transactions are not
+    missed; the duplicates are dropped by :func:`load_orders`.
+
+    :param db: Database session.
+    :type db: Session
+    :param output: Export directory.
+    :type output: str
+    :return: Number of exported orders.
+    :rtype: int
+
+    Example:
+        >>> export_orders(db, "exports/orders")
+    """
+    _require_pyarrow()
+    os.makedirs(output, exist_ok=True)
+
+    stmt = (
+        select(
+            Order.id.label("order_id"),
+            Order.user_id,
+            User.user_number,
+            Order.meal_id,
+            Meal.meal_number,
+            Meal.name.label("meal_name"),
+            Meal.date.label("meal_date"),
+            Order.status,
+            Order.withdrawed_at,
+            Order.updated_at
+        )
+        .join(User, Order.user_id == User.id)
+        .join(Meal, Order.meal_id == Meal.id)
+        .order_by(Order.updated_at)
+    )
+    watermark = read_watermark(output)
+    if watermark is not None:
+        overlap = datetime.timedelta(seconds=get_settings().analytics_watermark_overlap_seconds)
+        stmt = stmt.where(Order.updated_at > watermark - overlap)
+
+    # Sloupce rozdělené podle měsíce jídla
+    exported_at = datetime.datetime.now()
+    names = [name for name in ORDERS_SCHEMA.names if name != "exported_at"]
+    months: Dict[str, Dict[str, List[Any]]] = defaultdict(lambda: {name: [] for name in names})
+    exported = 0
+    newest = watermark
+    for row in db.execute(stmt).yield_per(10000):
+        columns = months[row.meal_date.strftime("%Y-%m")]
+        for name in names:
+            columns[name].append(getattr(row, name))
+        exported += 1
+        newest = row.updated_at if newest is None else max(newest, row.updated_at)
+
+    run_id = f"{exported_at:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    for month, columns in months.items():
+        partition = os.path.join(output, f"month={month}")
+        os.makedirs(partition, exist_ok=True)
+        columns["exported_at"] = [exported_at] * len(columns["order_id"])
+        table = pa.Table.from_pydict(columns, schema=ORDERS_SCHEMA)
+        pq.write_table(table, os.path.join(partition, f"part-{run_id}.parquet"))
+
+    if newest is not None:
+        write_watermark(output, newest)
+    return exported
+
+
+def load_orders(output: str, months: Optional[List[str]] = None) -> "pa.Table":
+    """
+    Load the exported orders, keeping only the latest version of every order.
+
+    :param output: Export directory.
+    :type output: str
+    :param months: Only load these months (``YYYY-MM``), all when None.
+    :type months: List[str] | None
+    :return: Table with one row per order.
+    :rtype: pyarrow.Table
+
+    Example:
+        >>> orders = load_orders("exports/orders", months=["2025-01", "2025-02"])
+        >>> orders.group_by("meal_number").aggregate([("status", "count")])
+    """
+    _require_pyarrow()
+    dataset = ds.dataset(output, format="parquet", partitioning="hive", schema=ORDERS_SCHEMA.append(pa.field("month", pa.string())))
+    table = dataset.to_table(filter=pc.field("month").isin(months) if months else None)
+    if table.num_rows == 0:
+        return table
+
+    # Poslední verze každé objednávky podle updated_at, při shodě podle času exportu
+    table = table.sort_by([("updated_at", "ascending"), ("exported_at", "ascending")])
+    table = table.append_column("_row", pa.array(range(table.num_rows), pa.int64()))
+    latest = table.group_by("order_id", use_threads=False).aggregate([("_row", "max")])
+    return table.take(latest["_row_max"]).drop_columns(["_row"])
+
+
+def main() -> None:
+    """
+    Parse command line arguments and run one incremental export.
+    """
+    from db.database import tenant_engines
+
+    parser = argparse.ArgumentParser(description="Export orders to month-partitioned Parquet files.")
+    parser.add_argument("--output", default=get_settings().analytics_export_dir, help="Export directory.")
+    parser.add_argument("--tenant", default=None, help="Tenant whose orders are exported. Defaults to the default database.")
+    args = parser.parse_args()
+
+    db = tenant_engines.session(args.tenant)
+    try:
+        exported = export_orders(db, args.output)
+    finally:
+        db.close()
+    print(f"Exported {exported} orders to {args.output}.")
+
+if __name__ == '__main__':
+    main()
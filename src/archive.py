@@ -0,0 +1,41 @@
+"""
+Command line job moving orders of closed school years to the ``orders_archive`` table.
+
+Meant to be run once the school year is over, e.g. from cron on 1 September::
+
+    python archive.py
+    python archive.py --before 2024-09-01
+    python archive.py --tenant gymnazium
+"""
+import argparse
+import datetime
+from db.database import tenant_engines
+from crud import archive_orders
+
+def main() -> None:
+    """
+    Parse command line arguments and archive orders older than the given date.
+    """
+    parser = argparse.ArgumentParser(description="Archive orders of closed school years.")
+    parser.add_argument(
+        "--before",
+        type=datetime.date.fromisoformat,
+        default=None,
+        help="Archive orders for meals dated before this day (YYYY-MM-DD). Defaults to the start of the current school year."
+    )
+    parser.add_argument(
+        "--tenant",
+        default=None,
+        help="Tenant whose database is archived. Defaults to the default database."
+    )
+    args = parser.parse_args()
+
+    db = tenant_engines.session(args.tenant)
+    try:
+        archived = archive_orders(db, before=args.before)
+    finally:
+        db.close()
+    print(f"Archived {archived} orders.")
+
+if __name__ == '__main__':
+    main()
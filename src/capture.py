@@ -0,0 +1,218 @@
+"""
+Opt-in capture of live traffic for replay benchmarks.
+
+When ``Settings.capture_file`` is set, :class:`CaptureMiddleware` appends one compact
+JSON line per request to that file::
+
+    {"t": 1736928000.123, "m": "GET", "r": "/users/meals-info/{ISIC_id}",
+     "p": {"ISIC_id": "~3f1c9a0b7d2e4f61"}, "q": {}, "s": 200, "d": 4.21, "n": 87}
+
+with the start time, method, route template, path and query parameters, JSON request
+body (``"b"``), status, duration in milliseconds and response size in bytes.
+Identifying values (ISIC ids, user numbers, names of people, passwords, search text) are
+replaced by pseudonyms keyed by ``Settings.capture_secret``, so the same student keeps
+the same pseudonym for the whole capture but cannot be recovered from it. The secret
+must be set explicitly whenever a capture file is; it is shared by all workers, so
+pseudonyms match across them. Headers are never captured.
+
+``name`` is a person's name everywhere except under the :data:`MEAL_ROUTES`, where it
+is the name of a meal and kept as is.
+
+Lines are buffered and appended in batches with a single ``write`` on a file opened
+with ``O_APPEND``, so all workers can share one file. ``benchmarks/replay.py`` replays
+a capture against a local instance.
+"""
+import atexit
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl
+from config import get_settings
+
+# Request fields and parameters holding personal data, replaced by pseudonyms
+ANONYMIZED_FIELDS = frozenset({
+    "ISIC_id", "ISIC_ids", "user_number", "user_numbers", "surname", "password", "q",
+})
+# Personal on every route except the meal routes
+PERSON_FIELDS = frozenset({"name"})
+# Route prefixes whose bodies name meals, not people
+MEAL_ROUTES = ("/meals",)
+
+FLUSH_LINES = 256
+FLUSH_SECONDS = 1.0
+
+
+def pseudonym(secret: bytes, value: Any) -> str:
+    """
+    Returns the stable pseudonym of an identifying value.
+
+    :param secret: Key of the pseudonyms.
+    :param value: The value to hide.
+    :return: ``~`` followed by 16 hex digits of a keyed hash of the value.
+    """
+    return "~" + hmac.new(secret, str(value).encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def anonymize(secret: bytes, data: Any, field: Optional[str] = None, people: bool = True) -> Any:
+    """
+    Replaces the values of :data:`ANONYMIZED_FIELDS` and names of people in a JSON document by pseudonyms.
+
+    :param secret: Key of the pseudonyms.
+    :param data: Parsed JSON document or parameter mapping.
+    :param field: Name of the field holding `data`, used when recursing.
+    :param people: Whether :data:`PERSON_FIELDS` name people, False on the :data:`MEAL_ROUTES`.
+    :return: Copy of `data` with identifying values replaced.
+    """
+    if isinstance(data, dict):
+        return {key: anonymize(secret, value, key, people) for key, value in data.items()}
+    if isinstance(data, list):
+        return [anonymize(secret, value, field, people) for value in data]
+    if data is not None and (field in ANONYMIZED_FIELDS or people and field in PERSON_FIELDS):
+        return pseudonym(secret, data)
+    return data
+
+
+class CaptureWriter:
+    """Buffers captured requests and appends them to a file in batches."""
+
+    def __init__(self, path: str):
+        """
+        Initializes CaptureWriter.
+
+        :param path: Path of the capture file, created if missing.
+        """
+        self.path = path
+        self._lines: List[bytes] = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """
+        Adds a captured request, flushing the buffer when it is full or old enough.
+
+        :param record: The captured request.
+        """
+        line = json.dumps(record, separators=(",", ":"), default=str).encode() + b"\n"
+        with self._lock:
+            self._lines.append(line)
+            if len(self._lines) < FLUSH_LINES and time.monotonic() - self._flushed_at < FLUSH_SECONDS:
+                return
+            lines, self._lines = self._lines, []
+            self._flushed_at = time.monotonic()
+        self._append(lines)
+
+    def flush(self) -> None:
+        """Appends all buffered requests to the file."""
+        with self._lock:
+            lines, self._lines = self._lines, []
+            self._flushed_at = time.monotonic()
+        self._append(lines)
+
+    def _append(self, lines: List[bytes]) -> None:
+        if not lines:
+            return
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            # One write per batch, so batches of concurrent workers never interleave
+            os.write(fd, b"".join(lines))
+        finally:
+            os.close(fd)
+
+
+def capture_enabled() -> bool:
+    """
+    Tells whether the capture middleware should be installed.
+
+    :return: True when a capture file is configured.
+    :raises RuntimeError: If a capture file is configured without a capture secret.
+    """
+    settings = get_settings()
+    if not settings.capture_file:
+        return False
+    if not settings.capture_secret:
+        raise RuntimeError("CAPTURE_FILE is set but CAPTURE_SECRET is not, refusing to capture traffic")
+    return True
+
+
+class CaptureMiddleware:
+    """ASGI middleware recording every HTTP request to the capture file."""
+
+    def __init__(self, app):
+        """
+        Initializes CaptureMiddleware from the application settings.
+
+        :param app: The wrapped ASGI application.
+        """
+        self.app = app
+        settings = get_settings()
+        if not settings.capture_secret:
+            raise RuntimeError("CAPTURE_SECRET is required to capture traffic")
+        self.secret = settings.capture_secret.encode()
+        self.max_body = settings.capture_max_body
+        self.writer = CaptureWriter(settings.capture_file)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            # uvicorn ends the process by re-raising the stop signal, atexit hooks may not run
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.writer.flush()
+            return
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = None
+        size = 0
+        body = bytearray()
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) <= self.max_body:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            self.writer.write(self._record(scope, bytes(body), started_at, duration, status, size))
+
+    def _record(self, scope, body: bytes, started_at: float, duration: float, status: Optional[int], size: int) -> Dict[str, Any]:
+        route = getattr(scope.get("route"), "path_format", scope["path"])
+        people = not route.startswith(MEAL_ROUTES)
+        query = {}
+        for key, value in parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True):
+            query.setdefault(key, []).append(value)
+        record = {
+            "t": round(started_at, 3),
+            "m": scope["method"],
+            "r": route,
+            "p": anonymize(self.secret, scope.get("path_params", {}), people=people),
+            "q": anonymize(self.secret, {key: v if len(v) > 1 else v[0] for key, v in query.items()}, people=people),
+            "s": status,
+            "d": round(duration * 1000, 3),
+            "n": size,
+        }
+        if body and len(body) <= self.max_body:
+            try:
+                record["b"] = anonymize(self.secret, json.loads(body), people=people)
+            except ValueError:
+                pass
+        return record
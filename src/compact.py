@@ -0,0 +1,162 @@
+"""
+Compact binary responses for the scanner terminals.
+
+The scan (``GET /users/meals-info/{ISIC_id}``) and offline sync
+(``POST /users/meals-info/batch``) endpoints answer with MessagePack or CBOR when the
+terminal asks for it in the ``Accept`` header, and with the usual JSON otherwise.
+Binary payloads are positional arrays with a fixed layout instead of maps, so field
+names are not repeated in every response, and they are encoded straight from the crud
+result without going through pydantic and the JSON encoder.
+
+The first element of every payload is :data:`FORMAT_VERSION`. Fields are only ever
+appended to a layout; a change of meaning or order bumps the version.
+
+Layout version 1::
+
+    meal info:  [1, meal_id, user_id, order_status, user_name, user_number,
+                 meal_number, meal_name, meal_date]
+    batch:      [1, [[ISIC_id, meal_id, user_id, order_status, user_name, user_number,
+                      meal_number, meal_name, meal_date], ...],
+                    [[ISIC_id, reason], ...]]
+    error:      [1, reason]
+
+``meal_date`` is the number of days since 1970-01-01 and ``reason`` is
+:data:`REASON_USER_NOT_FOUND` or :data:`REASON_NO_MEAL_TODAY`. A scan that finds no
+meal info answers 404 with the error layout in the negotiated format.
+
+The encoders are optional dependencies (``poetry install --with terminals``), a format
+whose library is missing is simply not offered in the negotiation.
+"""
+import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+from crud import NO_MEAL_TODAY, USER_NOT_FOUND
+
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+JSON = "application/json"
+
+FORMAT_VERSION = 1
+
+MEAL_INFO_FIELDS = (
+    "meal_id", "user_id", "order_status", "user_name", "user_number", "meal_number", "meal_name", "meal_date"
+)
+
+REASON_USER_NOT_FOUND = 1
+REASON_NO_MEAL_TODAY = 2
+REASONS = {USER_NOT_FOUND: REASON_USER_NOT_FOUND, NO_MEAL_TODAY: REASON_NO_MEAL_TODAY}
+
+EPOCH = datetime.date(1970, 1, 1)
+
+_ENCODERS: Dict[str, Callable[[Any], bytes]] = {}
+_DECODERS: Dict[str, Callable[[bytes], Any]] = {}
+if msgpack is not None:
+    _ENCODERS[MSGPACK] = lambda payload: msgpack.packb(payload, use_bin_type=True)
+    _DECODERS[MSGPACK] = lambda data: msgpack.unpackb(data, raw=False)
+if cbor2 is not None:
+    _ENCODERS[CBOR] = cbor2.dumps
+    _DECODERS[CBOR] = cbor2.loads
+
+# Alternative media types terminals may send
+_ALIASES = {"application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK}
+
+
+def negotiate(accept: str) -> Optional[str]:
+    """
+    Picks the response format from an ``Accept`` header.
+
+    :param accept: Value of the ``Accept`` header.
+    :return: :data:`MSGPACK` or :data:`CBOR` when the client prefers an available binary
+        format, None for JSON.
+    """
+    best: Tuple[float, int, Optional[str]] = (0.0, 0, None)
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        media_type = _ALIASES.get(media_type.lower(), media_type.lower())
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type in _ENCODERS or media_type == JSON:
+            # Highest quality wins, the earlier entry on a tie
+            candidate = (quality, -position, None if media_type == JSON else media_type)
+            if candidate[:2] > best[:2]:
+                best = candidate
+    return best[2] if best[0] > 0 else None
+
+
+def encode(media_type: str, payload: Any) -> bytes:
+    """
+    Encodes a payload built by :func:`meal_info_payload`, :func:`batch_payload` or :func:`error_payload`.
+
+    :param media_type: :data:`MSGPACK` or :data:`CBOR`.
+    :param payload: The payload.
+    :return: The encoded payload.
+    """
+    return _ENCODERS[media_type](payload)
+
+
+def decode(media_type: str, data: bytes) -> Any:
+    """
+    Decodes a binary payload, the counterpart of :func:`encode` for clients and benchmarks.
+
+    :param media_type: :data:`MSGPACK` or :data:`CBOR`.
+    :param data: The encoded payload.
+    :return: The decoded positional payload.
+    """
+    return _DECODERS[media_type](data)
+
+
+def _meal_info_values(info: Dict[str, Any]) -> List[Any]:
+    values = [info[field] for field in MEAL_INFO_FIELDS]
+    values[-1] = (info["meal_date"] - EPOCH).days
+    return values
+
+
+def meal_info_payload(info: Dict[str, Any]) -> List[Any]:
+    """
+    Lays out a result of :func:`crud.get_user_meal_info`.
+
+    :param info: The meal info.
+    :return: The positional payload.
+    """
+    return [FORMAT_VERSION, *_meal_info_values(info)]
+
+
+def batch_payload(result: Dict[str, List[Dict[str, Any]]]) -> List[Any]:
+    """
+    Lays out a result of :func:`crud.get_users_meal_info`.
+
+    :param result: Found and not found meal infos.
+    :return: The positional payload.
+    """
+    return [
+        FORMAT_VERSION,
+        [[info["ISIC_id"], *_meal_info_values(info)] for info in result["found"]],
+        [[entry["ISIC_id"], REASONS[entry["detail"]]] for entry in result["not_found"]],
+    ]
+
+
+def error_payload(detail: str) -> Optional[List[Any]]:
+    """
+    Lays out the detail of an error raised by :func:`crud.get_user_meal_info`.
+
+    :param detail: :data:`crud.USER_NOT_FOUND` or :data:`crud.NO_MEAL_TODAY`.
+    :return: The positional payload, None for other details, which stay JSON.
+    """
+    reason = REASONS.get(detail)
+    return None if reason is None else [FORMAT_VERSION, reason]
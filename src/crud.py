@@ -1,13 +1,32 @@
+import base64
+from collections import Counter
 from typing import Any, Dict, List, Optional
 from fastapi import HTTPException
-from sqlalchemy import desc
+from sqlalchemy import bindparam, delete, desc, func, insert, select, update
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import NoResultFound
-from db.models import User, Meal, Order
+from db.models import User, Meal, Order, OrderArchive, MealPortionShard
 from db.database import SessionLocal
 import datetime
-from schemas import UserCreate, MealCreate, OrderCreate, UserUpdate, MealUpdate, OrderUpdate
+from config import get_settings
+from schemas import (
+    UserCreate, MealCreate, OrderCreate, UserUpdate, MealUpdate, OrderUpdate, UserPatch, MealPatch, OrderPatch,
+    OrderBulkFilter
+)
+from tracing import traced
+from search import search_statement
+from menu import menu_cache, serialize_week, week_start, weeks_between
+from statements import (
+    USER_BY_NUMBER, USER_BY_ISIC, USER_BY_NAME, MEAL_BY_ID, MEAL_BY_NUMBER_AND_DATE, ORDER_BY_ID,
+    USER_MEAL_INFO, USER_ORDERS, USER_ORDERS_AFTER, USER_ORDER_HISTORY, USER_ORDER_HISTORY_AFTER, LATEST_ORDER_BY_USER, UPDATE_LATEST_ORDER_BY_USER,
+    LOCK_LATEST_ORDER_BY_USER, UPDATE_ORDER_BY_ID
+)
 
+# Důvody, proč sken nenašel jídlo, viz get_user_meal_info a get_users_meal_info
+USER_NOT_FOUND = "Tento uživatel nebyl nalezen"
+NO_MEAL_TODAY = "Tento uživatel dnes nemá jídlo"
+
+@traced
 def create_user(db: Session, user: UserCreate) -> User:
     """
     Create a new user in the database.
@@ -32,9 +51,9 @@ def create_user(db: Session, user: UserCreate) -> User:
     )
     db.add(db_user)
     db.commit()
-    db.refresh(db_user)
     return db_user
 
+@traced
 def get_all_users(db: Session) -> List[User]:
     """
     Retrieve all users from the database.
@@ -50,6 +69,7 @@ def get_all_users(db: Session) -> List[User]:
     return db.query(User).all()
 
 
+@traced
 def get_user_by_number(db: Session, user_number: str) -> User:
     """
     Retrieve a user from the database by ISIC ID.
@@ -64,12 +84,39 @@ def get_user_by_number(db: Session, user_number: str) -> User:
     Example:
         >>> get_user_by_ISIC(db, "123456")
     """
-    return db.query(User).filter(User.user_number == user_number).first()
+    return db.execute(USER_BY_NUMBER, {"user_number": user_number}).scalars().first()
+
+@traced
+def search_users(db: Session, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Search users by name and surname, ignoring case and diacritics.
+
+    Prefix matches rank first, then fuzzy matches by trigram similarity. Needs the
+    search index of the deployment SQL on Postgres; other databases only match a
+    case-insensitive substring, diacritics included.
 
+    :param db: Database session.
+    :type db: Session
+    :param query: Search text, e.g. the beginning of a name or a misspelled surname.
+    :type query: str
+    :param limit: Maximum number of results.
+    :type limit: int
+    :return: Best matching users with their ``score``.
+    :rtype: List[Dict[str, Any]]
+
+    Example:
+        >>> search_users(db, "novak", limit=5)
+    """
+    statement = search_statement(db.get_bind().dialect.name, query, limit)
+    return [dict(row) for row in db.execute(statement).mappings()]
+
+@traced
 def update_user(db: Session, user_number: int, user_update: UserUpdate) -> User:
     """
     Update user details based on ISIC ID.
 
+    Runs a single ``UPDATE ... RETURNING`` statement, see :func:`patch_user`.
+
     :param db: Database session.
     :type db: Session
     :param ISIC_id: The ISIC ID of the user to update.
@@ -83,22 +130,47 @@ def update_user(db: Session, user_number: int, user_update: UserUpdate) -> User:
         >>> updated_user = UserUpdate(name="John", surname="Doe", ISIC_id="123456", user_number=1, password="newpass")
         >>> update_user(db, 123456, updated_user)
     """
-    user = get_user_by_number(db, user_number)
-    if user:
-        user.name = user_update.name
-        user.surname = user_update.surname
-        user.ISIC_id = user_update.ISIC_id
-        user.user_number = user_update.user_number
-        user.password = user_update.password
-        db.commit()
-        db.refresh(user)
-        return user
-    return None
+    return patch_user(db, user_number, UserPatch(**user_update.model_dump()))
+
+@traced
+def patch_user(db: Session, user_number: int, user_patch: UserPatch) -> Optional[User]:
+    """
+    Partially update a user, changing only the fields supplied in `user_patch`.
+
+    The change is applied with a single ``UPDATE ... RETURNING`` statement, without
+    loading the user first or refreshing it afterwards.
 
+    :param db: Database session.
+    :type db: Session
+    :param user_number: Internal user number of the user to update.
+    :type user_number: int
+    :param user_patch: Fields to change.
+    :type user_patch: UserPatch
+    :return: The updated user object if found, else None.
+    :rtype: User | None
+
+    Example:
+        >>> patch_user(db, 1, UserPatch(password="newpass"))
+    """
+    values = user_patch.model_dump(exclude_unset=True)
+    if not values:
+        return get_user_by_number(db, user_number)
+
+    user = db.execute(
+        update(User).where(User.user_number == user_number).values(**values).returning(User)
+    ).scalars().first()
+    db.commit()
+    return user
+
+@traced
 def delete_user_by_ISIC(db: Session, user_number: int) -> None:
     """
     Delete a user from the database by ISIC ID.
 
+    The user's orders are removed first with one set-based ``DELETE ... RETURNING``, so the
+    portions they still held are given back to their meals, then the user is deleted.
+    Nothing is loaded into the session.
+
     :param db: Database session.
     :type db: Session
     :param ISIC_id: The ISIC ID of the user to delete.
@@ -108,11 +180,18 @@ def delete_user_by_ISIC(db: Session, user_number: int) -> None:
     Example:
         >>> delete_user_by_ISIC(db, 123456)
     """
-    user = get_user_by_number(db, user_number)
-    if user:
-        db.delete(user)
-        db.commit()
+    user_ids = select(User.id).where(User.user_number == user_number)
+    deleted = db.execute(
+        delete(Order)
+        .where(Order.user_id.in_(user_ids))
+        .returning(Order.meal_id, Order.status, Order.withdrawed_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _release_portions(db, [row.meal_id for row in deleted if _holds_portion(row)])
+    db.execute(delete(User).where(User.user_number == user_number))
+    db.commit()
 
+@traced
 def create_meal(db: Session, meal: MealCreate) -> Meal:
     """
     Create a new meal in the database.
@@ -128,12 +207,16 @@ def create_meal(db: Session, meal: MealCreate) -> Meal:
         >>> new_meal = MealCreate(meal_number=1, name="Pizza", date="2025-01-01")
         >>> create_meal(db, new_meal)
     """
-    db_meal = Meal(meal_number=meal.meal_number, name=meal.name, date=meal.date)
+    db_meal = Meal(meal_number=meal.meal_number, name=meal.name, date=meal.date, portions=meal.portions)
     db.add(db_meal)
+    if meal.portions is not None:
+        db.flush()
+        _reset_portion_shards(db, db_meal.id, meal.portions)
     db.commit()
-    db.refresh(db_meal)
+    menu_cache.invalidate(_database_key(db), db_meal.date)
     return db_meal
 
+@traced
 def get_meal_by_id(db: Session, meal_id: int) -> Meal:
     """
     Retrieve a meal from the database by ID.
@@ -148,8 +231,9 @@ def get_meal_by_id(db: Session, meal_id: int) -> Meal:
     Example:
         >>> get_meal_by_id(db, 1)
     """
-    return db.query(Meal).filter(Meal.id == meal_id).first()
+    return db.execute(MEAL_BY_ID, {"meal_id": meal_id}).scalars().first()
 
+@traced
 def get_all_meals(db: Session) -> List[Meal]:
     """
     Retrieve all meals from the database.
@@ -166,6 +250,7 @@ def get_all_meals(db: Session) -> List[Meal]:
 
 
 
+@traced
 def update_meal_by_id(db: Session, meal_id: int, meal_update: MealUpdate) -> Meal:
     """
     Update meal details based on meal ID.
@@ -179,30 +264,299 @@ def update_meal_by_id(db: Session, meal_id: int, meal_update: MealUpdate) -> Mea
     :return: The updated meal object if successful, else None.
     :rtype: Meal | None
     """
-    meal = get_meal_by_id(db, meal_id)
-    if meal:
-        meal.name = meal_update.name
-        meal.meal_number = meal_update.meal_number
-        db.commit()
-        db.refresh(meal)
-        return meal
-    return None
+    return patch_meal(db, meal_id, MealPatch(name=meal_update.name, meal_number=meal_update.meal_number))
 
+@traced
+def patch_meal(db: Session, meal_id: int, meal_patch: MealPatch) -> Optional[Meal]:
+    """
+    Partially update a meal, changing only the fields supplied in `meal_patch`.
+
+    The change is applied with a single ``UPDATE ... RETURNING`` statement, without
+    loading the meal first or refreshing it afterwards. Only a date change reads the
+    original date first, so the menu weeks of both dates are invalidated.
+
+    :param db: Database session.
+    :type db: Session
+    :param meal_id: The ID of the meal to update.
+    :type meal_id: int
+    :param meal_patch: Fields to change.
+    :type meal_patch: MealPatch
+    :return: The updated meal object if found, else None.
+    :rtype: Meal | None
+
+    Example:
+        >>> patch_meal(db, 1, MealPatch(name="Pizza"))
+    """
+    values = meal_patch.model_dump(exclude_unset=True)
+    if not values:
+        return get_meal_by_id(db, meal_id)
+
+    old_date = None
+    if "date" in values:
+        # Původní týden jídla je potřeba zneplatnit taky
+        old_date = db.execute(select(Meal.date).where(Meal.id == meal_id).with_for_update()).scalar()
+    meal = db.execute(
+        update(Meal).where(Meal.id == meal_id).values(**values).returning(Meal)
+    ).scalars().first()
+    if meal is not None and "portions" in values:
+        _reset_portion_shards(db, meal.id, meal.portions)
+    db.commit()
+    if meal is not None:
+        menu_cache.invalidate(_database_key(db), meal.date)
+        if old_date is not None:
+            menu_cache.invalidate(_database_key(db), old_date)
+    return meal
+
+def _reset_portion_shards(db: Session, meal_id: int, portions: Optional[int]) -> None:
+    """
+    Split the portions not yet ordered for a meal evenly across its shards.
+
+    Called when the capacity of a meal is set; no shards means unlimited portions.
+    Existing shards are updated in place, so a concurrent :func:`reserve_portion` never
+    finds a limited meal without shards. They are locked before the orders are counted:
+    a reservation in flight holds its shard until it commits, so its order is counted.
+    """
+    if portions is None:
+        db.execute(delete(MealPortionShard).where(MealPortionShard.meal_id == meal_id))
+        return
+
+    existing = set(db.execute(
+        select(MealPortionShard.shard).where(MealPortionShard.meal_id == meal_id).with_for_update()
+    ).scalars())
+    # Cancelled orders gave their portion back, withdrawn ones have eaten it
+    ordered = db.execute(
+        select(func.count()).where(Order.meal_id == meal_id, Order.status.is_not(False))
+    ).scalar_one()
+    remaining = max(portions - ordered, 0)
+    shards = get_settings().portion_shards
+    counts = {shard: remaining // shards + (shard < remaining % shards) for shard in range(shards)}
+
+    if existing & counts.keys():
+        db.execute(
+            update(MealPortionShard.__table__)
+            .where(MealPortionShard.meal_id == bindparam("m_id"), MealPortionShard.shard == bindparam("s_id"))
+            .values(remaining=bindparam("new_remaining")),
+            [{"m_id": meal_id, "s_id": shard, "new_remaining": counts[shard]} for shard in sorted(existing & counts.keys())]
+        )
+    if counts.keys() - existing:
+        db.execute(insert(MealPortionShard), [
+            {"meal_id": meal_id, "shard": shard, "remaining": counts[shard]} for shard in sorted(counts.keys() - existing)
+        ])
+    if existing - counts.keys():
+        # Shards left over from a larger PORTION_SHARDS setting
+        db.execute(delete(MealPortionShard).where(
+            MealPortionShard.meal_id == meal_id, MealPortionShard.shard.in_(existing - counts.keys())
+        ))
+
+@traced
+def reserve_portion(db: Session, meal_id: int) -> bool:
+    """
+    Atomically take one portion of a meal, without committing.
+
+    One shard with portions left is decremented with a conditional ``UPDATE``.
+    Shards locked by concurrent orders are skipped (``FOR UPDATE SKIP LOCKED``), so
+    simultaneous orders for the same meal spread over the shards instead of waiting
+    on one row. Only when every shard with portions left is locked does the
+    reservation wait for one of them. The ``remaining > 0`` condition is checked again
+    on the locked row, so a meal is never oversold.
+
+    Call it in the same transaction as the order insert, so a failed insert gives
+    the portion back on rollback.
+
+    :param db: Database session.
+    :type db: Session
+    :param meal_id: The ID of the meal.
+    :type meal_id: int
+    :return: True if a portion was reserved or the meal has no capacity limit, False if it is sold out.
+    :rtype: bool
+    """
+    skip_locked = True
+    while True:
+        shard = (
+            select(MealPortionShard.shard)
+            .where(MealPortionShard.meal_id == meal_id, MealPortionShard.remaining > 0)
+            .order_by(func.random())
+            .limit(1)
+            .with_for_update(skip_locked=skip_locked)
+            .scalar_subquery()
+        )
+        reserved = db.execute(
+            update(MealPortionShard)
+            .where(
+                MealPortionShard.meal_id == meal_id,
+                MealPortionShard.shard == shard,
+                MealPortionShard.remaining > 0
+            )
+            .values(remaining=MealPortionShard.remaining - 1)
+            .returning(MealPortionShard.shard)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if reserved is not None:
+            return True
+
+        remaining = get_remaining_portions(db, meal_id)
+        if remaining is None:
+            return True
+        if remaining == 0:
+            return False
+        # Portions are left only in shards locked by concurrent orders, wait for them
+        skip_locked = False
+
+@traced
+def release_portion(db: Session, meal_id: int) -> None:
+    """
+    Give one portion of a meal back, without committing.
+
+    Does nothing for meals without a capacity limit.
+
+    :param db: Database session.
+    :type db: Session
+    :param meal_id: The ID of the meal.
+    :type meal_id: int
+    """
+    shard = (
+        select(MealPortionShard.shard)
+        .where(MealPortionShard.meal_id == meal_id)
+        .order_by(func.random())
+        .limit(1)
+        .scalar_subquery()
+    )
+    db.execute(
+        update(MealPortionShard)
+        .where(MealPortionShard.meal_id == meal_id, MealPortionShard.shard == shard)
+        .values(remaining=MealPortionShard.remaining + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+def _holds_portion(order: Any) -> bool:
+    """
+    Tells whether a removed order still held an unused portion, i.e. was active and not withdrawn.
+    """
+    return order.status is not False and order.withdrawed_at is None
+
+def _release_portions(db: Session, meal_ids: List[int]) -> None:
+    """
+    Give back one portion for every entry of `meal_ids`, without committing.
+
+    Portions of the same meal are summed and returned to its first shard, one
+    ``UPDATE`` per distinct meal in a single executemany.
+    """
+    counts = Counter(meal_ids)
+    if not counts:
+        return
+    db.execute(
+        update(MealPortionShard.__table__)
+        .where(MealPortionShard.meal_id == bindparam("m_id"), MealPortionShard.shard == 0)
+        .values(remaining=MealPortionShard.remaining + bindparam("released")),
+        [{"m_id": meal_id, "released": released} for meal_id, released in counts.items()]
+    )
+
+@traced
+def get_remaining_portions(db: Session, meal_id: int) -> Optional[int]:
+    """
+    Retrieve the number of portions of a meal that can still be ordered.
+
+    Sums the meal's portion shards instead of counting its orders.
+
+    :param db: Database session.
+    :type db: Session
+    :param meal_id: The ID of the meal.
+    :type meal_id: int
+    :return: Remaining portions, None when the meal has no capacity limit.
+    :rtype: int | None
+
+    Example:
+        >>> get_remaining_portions(db, 1)
+    """
+    return db.execute(
+        select(func.sum(MealPortionShard.remaining)).where(MealPortionShard.meal_id == meal_id)
+    ).scalar()
+
+@traced
 def delete_meal_by_id(db: Session, meal_id: int) -> None:
     """
     Delete a meal from the database by ID.
 
+    Runs a single ``DELETE`` statement; orders of the meal are removed by the
+    ``ON DELETE CASCADE`` foreign key without being loaded.
+
     :param db: Database session.
     :type db: Session
     :param meal_id: The ID of the meal to delete.
     :type meal_id: int
     """
-    meal = get_meal_by_id(db, meal_id)
-    if meal:
-        db.delete(meal)
-        db.commit()
+    deleted = db.execute(delete(Meal).where(Meal.id == meal_id).returning(Meal.date)).first()
+    db.commit()
+    if deleted is not None:
+        menu_cache.invalidate(_database_key(db), deleted.date)
+
+@traced
+def delete_meals_by_date_range(db: Session, date_from: datetime.date, date_to: datetime.date) -> int:
+    """
+    Delete all meals dated within a range, e.g. old menus.
+
+    Runs a single ``DELETE`` statement; orders of the meals are removed by the
+    ``ON DELETE CASCADE`` foreign key without being loaded.
 
+    :param db: Database session.
+    :type db: Session
+    :param date_from: First day of the range (inclusive).
+    :type date_from: datetime.date
+    :param date_to: Last day of the range (inclusive).
+    :type date_to: datetime.date
+    :return: Number of deleted meals.
+    :rtype: int
+
+    Example:
+        >>> delete_meals_by_date_range(db, datetime.date(2024, 9, 1), datetime.date(2025, 6, 30))
+    """
+    result = db.execute(delete(Meal).where(Meal.date.between(date_from, date_to)))
+    db.commit()
+    for monday in weeks_between(date_from, date_to):
+        menu_cache.invalidate(_database_key(db), monday)
+    return result.rowcount
+
+def _database_key(db: Session) -> str:
+    """Key of the session's database in per-database caches."""
+    return str(db.get_bind().url)
+
+@traced
+def get_menu_calendar(db: Session, date_from: datetime.date, date_to: datetime.date) -> bytes:
+    """
+    Retrieve the menu of all ISO weeks overlapping a date range as serialized JSON.
 
+    Weeks are served from :data:`menu.menu_cache`; a missing week is loaded with
+    one indexed range query on ``meals.date``.
+
+    :param db: Database session.
+    :type db: Session
+    :param date_from: First day of the range.
+    :type date_from: datetime.date
+    :param date_to: Last day of the range.
+    :type date_to: datetime.date
+    :return: UTF-8 encoded JSON object with the weeks, meals grouped by date and meal number.
+    :rtype: bytes
+
+    Example:
+        >>> get_menu_calendar(db, datetime.date(2025, 1, 13), datetime.date(2025, 1, 26))
+    """
+    database = _database_key(db)
+
+    def build(monday: datetime.date) -> bytes:
+        meals = db.execute(
+            select(Meal)
+            .where(Meal.date.between(monday, monday + datetime.timedelta(days=6)))
+            .order_by(Meal.date, Meal.meal_number)
+        ).scalars()
+        return serialize_week(monday, meals)
+
+    weeks = [menu_cache.get_week(database, monday, lambda: build(monday)) for monday in weeks_between(date_from, date_to)]
+    first = week_start(date_from)
+    last = week_start(date_to) + datetime.timedelta(days=6)
+    return b'{"from":"%s","to":"%s","weeks":[%s]}' % (first.isoformat().encode(), last.isoformat().encode(), b",".join(weeks))
+
+
+@traced
 def create_order(db: Session, order: OrderCreate) -> Order:
     """
     Create a new order in the database by finding user_id based on name and surname,
@@ -218,23 +572,26 @@ def create_order(db: Session, order: OrderCreate) -> Order:
     """
     try:
         # Hledání uživatele podle jména a příjmení
-        user = db.query(User).filter(
-            User.name == order.name,
-            User.surname == order.surname
-        ).one()
+        user = db.execute(
+            USER_BY_NAME, {"name": order.name, "surname": order.surname}
+        ).scalar_one()
     except NoResultFound:
         raise ValueError(f"User '{order.name} {order.surname}' not found.")
 
     try:
         # Hledání jídla podle meal_number a dnešního data
         today = datetime.date.today()
-        meal = db.query(Meal).filter(
-            Meal.meal_number == order.meal_number,
-            Meal.date == today
-        ).one()
+        meal = db.execute(
+            MEAL_BY_NUMBER_AND_DATE, {"meal_number": order.meal_number, "date": today}
+        ).scalar_one()
     except NoResultFound:
         raise HTTPException(detail=f"Meal with number {order.meal_number} for today ({today}) not found.", status_code=404)
 
+    # Rezervace porce ve stejné transakci jako vložení objednávky
+    if meal.portions is not None and not reserve_portion(db, meal.id):
+        db.rollback()
+        raise HTTPException(detail=f"Meal with number {order.meal_number} for today ({today}) is sold out.", status_code=409)
+
     # Vytvoření objednávky s nalezeným user_id a meal_id
     db_order = Order(
         user_id=user.id,
@@ -245,9 +602,70 @@ def create_order(db: Session, order: OrderCreate) -> Order:
 
     db.add(db_order)
     db.commit()
-    db.refresh(db_order)
     return db_order
 
+def _encode_cursor(meal_date: datetime.date, order_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{meal_date.isoformat()}|{order_id}".encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        meal_date, order_id = raw.split("|")
+        return {"cursor_date": datetime.date.fromisoformat(meal_date), "cursor_id": int(order_id)}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@traced
+def get_user_orders(
+    db: Session, user_number: int, cursor: Optional[str] = None, limit: int = 20, include_archive: bool = False
+) -> Optional[Dict[str, Any]]:
+    """
+    Retrieve one page of a user's orders with their meals, newest meal date first.
+
+    Pages are addressed by a keyset cursor on ``(meal_date, order_id)``, so every page
+    reads only the user's orders through ``ix_orders_user_meal`` and their meals by
+    primary key, however deep it is and however large the tables grow. With
+    `include_archive` the orders of closed school years in ``orders_archive`` are
+    merged in under the same cursor.
+
+    :param db: Database session.
+    :type db: Session
+    :param user_number: The unique number identifying the user.
+    :type user_number: int
+    :param cursor: ``next_cursor`` of the previous page, None for the first page.
+    :type cursor: str | None
+    :param limit: Maximum number of orders on the page.
+    :type limit: int
+    :param include_archive: Whether to include archived orders of closed school years.
+    :type include_archive: bool
+    :return: The orders and the cursor of the next page, None if the user does not exist.
+    :rtype: Dict[str, Any] | None
+    :raises HTTPException: If the cursor is malformed.
+
+    Example:
+        >>> page = get_user_orders(db, 1023, limit=10)
+        >>> get_user_orders(db, 1023, cursor=page["next_cursor"], limit=10)
+        >>> get_user_orders(db, 1023, include_archive=True)
+    """
+    user = db.execute(USER_BY_NUMBER, {"user_number": user_number}).scalars().first()
+    if user is None:
+        return None
+
+    # O jeden řádek víc, aby bylo poznat, jestli existuje další stránka
+    params = {"user_id": user.id, "limit": limit + 1}
+    first, after = (USER_ORDER_HISTORY, USER_ORDER_HISTORY_AFTER) if include_archive else (USER_ORDERS, USER_ORDERS_AFTER)
+    if cursor is None:
+        rows = db.execute(first, params).mappings().all()
+    else:
+        rows = db.execute(after, {**params, **_decode_cursor(cursor)}).mappings().all()
+
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = _encode_cursor(items[-1]["meal_date"], items[-1]["order_id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+@traced
 def get_order_by_id(db: Session, order_id: int) -> Order:
     """
     Retrieve an order from the database by ID.
@@ -259,29 +677,39 @@ def get_order_by_id(db: Session, order_id: int) -> Order:
     :return: The order object if found, else None.
     :rtype: Order | None
     """
-    return db.query(Order).filter(Order.id == order_id).first()
+    return db.execute(ORDER_BY_ID, {"order_id": order_id}).scalars().first()
 
-def get_all_orders(db: Session) -> List[Order]:
+@traced
+def get_all_orders(db: Session, include_archive: bool = False) -> List[Order]:
     """
     Retrieve all orders from the database.
 
+    Only orders of the current school year are read unless `include_archive` is set,
+    in which case orders moved to ``orders_archive`` are appended as well.
+
     :param db: Database session.
     :type db: Session
+    :param include_archive: Whether to include archived orders of closed school years.
+    :type include_archive: bool
     :return: List of all orders.
     :rtype: List[Order]
     
     Example:
         >>> get_all_orders(db)
+        >>> get_all_orders(db, include_archive=True)
     """
-    return db.query(Order).all()
+    orders = db.query(Order).all()
+    if include_archive:
+        orders += db.query(OrderArchive).all()
+    return orders
 
+@traced
 def update_order(db: Session, user_number: int, order_update: OrderUpdate) -> Optional[Order]:
     """
     Update an order based on the user's student number (user_number).
 
-    This function first looks up a user by their user_number. If the user exists,
-    it finds the most recent order associated with the user and updates it with the new data
-    provided in the `order_update` schema.
+    The most recent order associated with the user is updated with the new data
+    provided in the `order_update` schema, see :func:`patch_order`.
 
     :param db: The SQLAlchemy database session.
     :type db: Session
@@ -292,42 +720,194 @@ def update_order(db: Session, user_number: int, order_update: OrderUpdate) -> Op
     :return: The updated Order object if successful, otherwise None.
     :rtype: Optional[Order]
     """
+    values = order_update.model_dump()
+    # status must not be null, a replacement without it keeps the current one
+    if values["status"] is None:
+        del values["status"]
+    return patch_order(db, user_number, OrderPatch(**values))
 
-    # Find user by student number
-    user = db.query(User).filter(User.user_number == user_number).first()
-    if not user:
-        return None
+@traced
+def patch_order(db: Session, user_number: int, order_patch: OrderPatch) -> Optional[Order]:
+    """
+    Partially update the most recent order of a user, changing only the fields supplied in `order_patch`.
 
-    # Find the most recent order by user_id (adjust logic if needed)
-    order = db.query(Order).filter(Order.user_id == user.id).order_by(Order.id.desc()).first()
-    if not order:
-        return None
+    The user and their latest order are found by a subquery of the same prebuilt
+    ``UPDATE ... RETURNING`` statement, so the update is a single round trip. A patch
+    of ``status`` or ``meal_id`` locks the order first: cancelling an active, not yet
+    withdrawn order gives its portion back, activating a cancelled one reserves a
+    portion of its (new) meal again, like :func:`cancel_orders` and :func:`create_order`,
+    and moving an active order to another meal gives back the old portion and reserves
+    a new one.
 
-    # Apply updates to the order
-    order.user_id = order_update.user_id
-    order.meal_id = order_update.meal_id
-    order.status = order_update.status
-    order.withdrawed_at = order_update.withdrawed_at
+    :param db: The SQLAlchemy database session.
+    :type db: Session
+    :param user_number: The unique number identifying the user (used instead of user_id).
+    :type user_number: int
+    :param order_patch: Fields to change.
+    :type order_patch: OrderPatch
+    :return: The updated Order object if successful, otherwise None.
+    :rtype: Optional[Order]
+    :raises HTTPException: 409 if the order needs a portion of a meal that is sold out.
 
-    # Commit changes to the database
+    Example:
+        >>> patch_order(db, 1023, OrderPatch(status=False, withdrawed_at=datetime.datetime.now()))
+    """
+    params = {"user_number": user_number}
+    values = order_patch.model_dump(exclude_unset=True)
+    if not values:
+        return db.execute(LATEST_ORDER_BY_USER, params).scalars().first()
+    if "status" not in values and "meal_id" not in values:
+        order = db.execute(UPDATE_LATEST_ORDER_BY_USER.values(**values), params).scalars().first()
+        db.commit()
+        return order
+
+    current = db.execute(LOCK_LATEST_ORDER_BY_USER.execution_options(populate_existing=True), params).scalars().first()
+    if current is None:
+        db.rollback()
+        return None
+    # Only an order that was not withdrawn gave its portion back when it was cancelled
+    held, released = _holds_portion(current), current.status is False and current.withdrawed_at is None
+    old_meal_id = current.meal_id
+    order = db.execute(
+        UPDATE_ORDER_BY_ID.values(**values), {"order_id": current.id},
+        execution_options={"populate_existing": True}
+    ).scalars().first()
+    moved = order.meal_id != old_meal_id
+    if held and (order.status is False or moved):
+        release_portion(db, old_meal_id)
+    # An order taking a portion again, or moved to another meal, reserves one of its new meal
+    if (held and moved and order.status is not False) or (released and order.status is not False):
+        if not reserve_portion(db, order.meal_id):
+            db.rollback()
+            raise HTTPException(detail=f"Meal {order.meal_id} of the order is sold out.", status_code=409)
     db.commit()
-    db.refresh(order)
     return order
 
+@traced
 def delete_order(db: Session, order_id: int) -> None:
     """
     Delete an order from the database by ID.
 
+    The portion reserved by an active, not yet withdrawn order is given back to its meal.
+    Cancelled orders already gave theirs back, see :func:`cancel_orders`.
+
     :param db: Database session.
     :type db: Session
     :param order_id: The ID of the order to delete.
     :type order_id: int
     """
-    order = get_order_by_id(db, order_id)
-    if order:
-        db.delete(order)
-        db.commit()
+    deleted = db.execute(
+        delete(Order).where(Order.id == order_id).returning(Order.meal_id, Order.status, Order.withdrawed_at)
+    ).first()
+    if deleted is not None and _holds_portion(deleted):
+        release_portion(db, deleted.meal_id)
+    db.commit()
+
+def _bulk_order_criteria(bulk: OrderBulkFilter) -> List[Any]:
+    """
+    Builds the ``WHERE`` criteria of a bulk order operation as subqueries, so no rows are loaded.
+    """
+    meal_criteria = []
+    if bulk.date is not None:
+        meal_criteria.append(Meal.date == bulk.date)
+    if bulk.meal_number is not None:
+        meal_criteria.append(Meal.meal_number == bulk.meal_number)
+    if bulk.meal_id is not None:
+        meal_criteria.append(Meal.id == bulk.meal_id)
+
+    criteria = []
+    if meal_criteria:
+        criteria.append(Order.meal_id.in_(select(Meal.id).where(*meal_criteria)))
+    if bulk.user_numbers is not None:
+        criteria.append(Order.user_id.in_(select(User.id).where(User.user_number.in_(bulk.user_numbers))))
+    return criteria
+
+@traced
+def cancel_orders(db: Session, bulk: OrderBulkFilter) -> int:
+    """
+    Cancel all active, not yet withdrawn orders matching `bulk`.
+
+    Runs a single ``UPDATE`` setting ``status`` to False and gives the portions of the
+    cancelled orders back to their meals in the same transaction.
+
+    :param db: Database session.
+    :type db: Session
+    :param bulk: Filters selecting the orders.
+    :type bulk: OrderBulkFilter
+    :return: Number of cancelled orders.
+    :rtype: int
+
+    Example:
+        >>> cancel_orders(db, OrderBulkFilter(date=datetime.date(2025, 3, 14)))
+    """
+    cancelled = db.execute(
+        update(Order)
+        .where(*_bulk_order_criteria(bulk), Order.status.is_not(False), Order.withdrawed_at.is_(None))
+        .values(status=False)
+        .returning(Order.meal_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    _release_portions(db, cancelled)
+    db.commit()
+    return len(cancelled)
+
+@traced
+def withdraw_orders(db: Session, bulk: OrderBulkFilter, withdrawed_at: Optional[datetime.datetime] = None) -> int:
+    """
+    Mark all active, not yet withdrawn orders matching `bulk` as withdrawn.
+
+    Runs a single ``UPDATE``.
+
+    :param db: Database session.
+    :type db: Session
+    :param bulk: Filters selecting the orders.
+    :type bulk: OrderBulkFilter
+    :param withdrawed_at: Time of the withdrawal, defaults to now.
+    :type withdrawed_at: datetime.datetime | None
+    :return: Number of withdrawn orders.
+    :rtype: int
+
+    Example:
+        >>> withdraw_orders(db, OrderBulkFilter(meal_id=42))
+    """
+    withdrawn = db.execute(
+        update(Order)
+        .where(*_bulk_order_criteria(bulk), Order.status.is_not(False), Order.withdrawed_at.is_(None))
+        .values(withdrawed_at=withdrawed_at or datetime.datetime.now()),
+        execution_options={"synchronize_session": False}
+    )
+    db.commit()
+    return withdrawn.rowcount
+
+@traced
+def delete_orders(db: Session, bulk: OrderBulkFilter) -> int:
+    """
+    Delete all orders matching `bulk`.
 
+    Runs a single ``DELETE`` and gives the portions of deleted orders that were still
+    active and not withdrawn back to their meals in the same transaction.
+
+    :param db: Database session.
+    :type db: Session
+    :param bulk: Filters selecting the orders.
+    :type bulk: OrderBulkFilter
+    :return: Number of deleted orders.
+    :rtype: int
+
+    Example:
+        >>> delete_orders(db, OrderBulkFilter(date=datetime.date(2025, 3, 14), user_numbers=[1023, 1024]))
+    """
+    deleted = db.execute(
+        delete(Order)
+        .where(*_bulk_order_criteria(bulk))
+        .returning(Order.meal_id, Order.status, Order.withdrawed_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _release_portions(db, [row.meal_id for row in deleted if _holds_portion(row)])
+    db.commit()
+    return len(deleted)
+
+@traced
 def get_user_meal_info(db: Session, isic_id: str) -> Dict[str, Any]:
     """
     Retrieve user and meal information based on ISIC_id, but only for today's meals.
@@ -346,30 +926,17 @@ def get_user_meal_info(db: Session, isic_id: str) -> Dict[str, Any]:
     today = datetime.date.today()
 
     # Získání ID uživatele podle ISIC_id
-    user = db.query(User).filter(User.ISIC_id == isic_id).first()
+    user = db.execute(USER_BY_ISIC, {"isic_id": isic_id}).scalars().first()
     if not user:
-        raise HTTPException(status_code=404, detail="Tento uživatel nebyl nalezen")
+        raise HTTPException(status_code=404, detail=USER_NOT_FOUND)
 
     # Hledání objednávky pouze pro dnešní datum
-    result = (
-        db.query(
-            Meal.id.label("meal_id"),
-            User.id.label("user_id"),
-            Order.status.label("order_status"),
-            User.name.label("user_name"), 
-            Meal.meal_number.label("meal_number"), 
-            Meal.name.label("meal_name"), 
-            User.user_number.label("user_number"),
-            Meal.date.label("meal_date")
-        )
-        .join(Order, Order.user_id == User.id)
-        .join(Meal, Order.meal_id == Meal.id)
-        .filter(Order.user_id == user.id, Meal.date == today)
-        .first()  # Vrátí pouze první nalezenou objednávku pro dnešek
-    )
+    result = db.execute(
+        USER_MEAL_INFO, {"user_id": user.id, "date": today}
+    ).first()  # Vrátí pouze první nalezenou objednávku pro dnešek
 
     if not result:
-        raise HTTPException(status_code=404, detail="Tento uživatel dnes nemá jídlo")
+        raise HTTPException(status_code=404, detail=NO_MEAL_TODAY)
 
     return {
         "meal_id": result.meal_id,
@@ -380,4 +947,156 @@ def get_user_meal_info(db: Session, isic_id: str) -> Dict[str, Any]:
         "meal_number": result.meal_number,
         "meal_name": result.meal_name,
         "meal_date": result.meal_date
-    }
\ No newline at end of file
+    }
+
+@traced
+def get_users_meal_info(db: Session, isic_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Retrieve user and meal information for many ISIC ids at once, only for today's meals.
+
+    All ids are resolved with a single query joining users with today's orders, so the
+    cost does not grow with the number of ids.
+
+    :param db: Database session.
+    :type db: Session
+    :param isic_ids: ISIC IDs of the users.
+    :type isic_ids: List[str]
+    :return: Dictionary with ``found`` meal infos (same shape as :func:`get_user_meal_info`)
+        and ``not_found`` entries with the ISIC ID and the reason.
+    :rtype: Dict[str, List[Dict[str, Any]]]
+
+    Example:
+        >>> get_users_meal_info(db, ["123456789", "987654321"])
+    """
+    today = datetime.date.today()
+    isic_ids = list(dict.fromkeys(isic_ids))
+
+    # Dnešní objednávky, připojené k uživatelům vnějším joinem
+    todays_orders = (
+        select(
+            Order.id.label("order_id"),
+            Order.user_id,
+            Order.status,
+            Meal.id.label("meal_id"),
+            Meal.meal_number,
+            Meal.name,
+            Meal.date
+        )
+        .join(Meal, Order.meal_id == Meal.id)
+        .where(Meal.date == today)
+        .subquery()
+    )
+    rows = (
+        db.query(
+            User.ISIC_id.label("isic_id"),
+            User.id.label("user_id"),
+            User.name.label("user_name"),
+            User.user_number.label("user_number"),
+            todays_orders.c.order_id,
+            todays_orders.c.meal_id,
+            todays_orders.c.status.label("order_status"),
+            todays_orders.c.meal_number,
+            todays_orders.c.name.label("meal_name"),
+            todays_orders.c.date.label("meal_date")
+        )
+        .outerjoin(todays_orders, todays_orders.c.user_id == User.id)
+        .filter(User.ISIC_id.in_(isic_ids))
+        .order_by(todays_orders.c.order_id)
+        .all()
+    )
+
+    # Stejně jako get_user_meal_info bere první nalezenou objednávku
+    by_isic = {}
+    for row in rows:
+        if row.isic_id not in by_isic or by_isic[row.isic_id].order_id is None:
+            by_isic[row.isic_id] = row
+
+    found = []
+    not_found = []
+    for isic_id in isic_ids:
+        row = by_isic.get(isic_id)
+        if row is None:
+            not_found.append({"ISIC_id": isic_id, "detail": USER_NOT_FOUND})
+        elif row.order_id is None:
+            not_found.append({"ISIC_id": isic_id, "detail": NO_MEAL_TODAY})
+        else:
+            found.append({
+                "ISIC_id": isic_id,
+                "meal_id": row.meal_id,
+                "user_id": row.user_id,
+                "order_status": row.order_status,
+                "user_name": row.user_name,
+                "user_number": row.user_number,
+                "meal_number": row.meal_number,
+                "meal_name": row.meal_name,
+                "meal_date": row.meal_date
+            })
+
+    return {"found": found, "not_found": not_found}
+
+def school_year_start(day: datetime.date) -> datetime.date:
+    """
+    Return the first day of the school year containing the given date.
+
+    School years start on 1 September.
+
+    :param day: Any date within the school year.
+    :type day: datetime.date
+    :return: The 1 September opening the school year.
+    :rtype: datetime.date
+
+    Example:
+        >>> school_year_start(datetime.date(2025, 3, 14))
+        datetime.date(2024, 9, 1)
+    """
+    year = day.year if day.month >= 9 else day.year - 1
+    return datetime.date(year, 9, 1)
+
+@traced
+def archive_orders(db: Session, before: Optional[datetime.date] = None) -> int:
+    """
+    Move orders of closed school years from ``orders`` to ``orders_archive``.
+
+    Orders whose meal is dated before `before` are removed from the hot table and the
+    removed rows are inserted into the archive, on Postgres in one statement, so queries
+    on ``orders`` only ever scan the current school year.
+
+    :param db: Database session.
+    :type db: Session
+    :param before: Orders for meals dated before this day are archived.
+        Defaults to the start of the current school year.
+    :type before: datetime.date | None
+    :return: Number of archived orders.
+    :rtype: int
+
+    Example:
+        >>> archive_orders(db)
+        >>> archive_orders(db, before=datetime.date(2024, 9, 1))
+    """
+    if before is None:
+        before = school_year_start(datetime.date.today())
+
+    closed_meals = select(Meal.id).where(Meal.date < before)
+    columns = ["id", "user_id", "meal_id", "status", "withdrawed_at"]
+    moved_rows = (
+        delete(Order)
+        .where(Order.meal_id.in_(closed_meals))
+        .returning(Order.id, Order.user_id, Order.meal_id, Order.status, Order.withdrawed_at)
+    )
+
+    if db.get_bind().dialect.name == "postgresql":
+        # WITH moved AS (DELETE ... RETURNING ...) INSERT ... SELECT FROM moved: archived rows
+        # are exactly the deleted ones, an order committed meanwhile is never lost
+        moved = moved_rows.cte("moved")
+        result = db.execute(
+            insert(OrderArchive).from_select(columns, select(*(moved.c[column] for column in columns)))
+        )
+        archived = result.rowcount
+    else:
+        # Databases without data-modifying CTEs archive the rows the DELETE returned
+        rows = db.execute(moved_rows, execution_options={"synchronize_session": False}).mappings().all()
+        if rows:
+            db.execute(insert(OrderArchive), [dict(row) for row in rows])
+        archived = len(rows)
+    db.commit()
+    return archived
@@ -1,13 +1,213 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
 from config import get_settings
 
->>>>>>> HEAD
-DATABASE_URL = ""
->>>>>>>
-
 DATABASE_URL = get_settings().neondb_string
->>>>>>> 0611f6d (changed db)
 
-engine = create_engine(DATABASE_URL, echo=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def pool_size_per_worker(max_connections: int, workers: int, overflow_ratio: float) -> Tuple[int, int]:
+    """
+    Split a database's connection budget between the server worker processes.
+
+    Every worker has its own engine and pool, so the budget is divided by the number
+    of workers and then into persistent connections and temporary overflow.
+
+    :param max_connections: Total connections all workers may open to one database.
+    :type max_connections: int
+    :param workers: Number of server worker processes.
+    :type workers: int
+    :param overflow_ratio: Share of each worker's connections opened only under load, ``0 <= ratio < 1``.
+    :type overflow_ratio: float
+    :return: Pool size and max overflow of one worker. The pool size is at least 1, since
+        SQLAlchemy takes 0 for an unlimited pool.
+    :rtype: Tuple[int, int]
+    :raises ValueError: If `overflow_ratio` is out of range.
+
+    Example:
+        >>> pool_size_per_worker(20, 4, 0.25)
+        (4, 1)
+    """
+    if not 0 <= overflow_ratio < 1:
+        raise ValueError(f"overflow_ratio must be at least 0 and below 1, got {overflow_ratio}")
+    # One connection per worker even when there are more workers than connections
+    per_worker = max(max_connections // max(workers, 1), 1)
+    pool_size = max(per_worker - int(per_worker * overflow_ratio), 1)
+    return pool_size, per_worker - pool_size
+
+def make_engine(url: str) -> Engine:
+    """
+    Create an engine with the options used for every database of the service.
+
+    The pool is sized from ``Settings.db_max_connections`` divided between
+    ``Settings.server_workers``; SQLite keeps its default pool.
+
+    :param url: Database URL.
+    :type url: str
+    :return: The new engine.
+    :rtype: Engine
+    """
+    settings = get_settings()
+    options = {"echo": settings.db_echo}
+    if make_url(url).get_backend_name() != "sqlite":
+        pool_size, max_overflow = pool_size_per_worker(
+            settings.db_max_connections, settings.server_workers, settings.db_pool_overflow_ratio
+        )
+        options.update(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_pre_ping=True,
+        )
+    return create_engine(url, **options)
+
+engine = make_engine(DATABASE_URL)
+# Objects stay loaded after commit, so writes don't need a refresh SELECT
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+
+class UnknownTenantError(KeyError):
+    """Raised when a request names a tenant with no configured database."""
+
+
+class TenantEngines:
+    """
+    Lazily created, bounded set of engines, one per tenant database.
+
+    Each tenant maps to a database URL in ``Settings.tenant_databases``. A tenant
+    using its own schema in a shared Postgres database can point at it with
+    ``?options=-csearch_path%3D<schema>`` in the URL. Engines are created on first
+    use; when more than `max_engines` exist or an engine has been idle for
+    `idle_seconds`, it is disposed and its connections are closed.
+
+    An engine is created and set up outside the lock shared by all tenants, so a
+    slow or unreachable tenant database only delays requests of that tenant.
+    """
+
+    def __init__(self, databases: Dict[str, str], max_engines: int, idle_seconds: float):
+        """
+        Initializes TenantEngines.
+
+        :param databases: Database URL per tenant.
+        :param max_engines: Maximum number of engines kept open at once.
+        :param idle_seconds: Engines not used for this long are disposed.
+        """
+        self.databases = databases
+        self.max_engines = max_engines
+        self.idle_seconds = idle_seconds
+        self.hooks: List[Callable[[Engine], None]] = []
+        self.schema_hooks: List[Callable[[Engine], None]] = []
+        self._engines: "OrderedDict[str, Engine]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # One lock per tenant serializing the creation of its engine
+        self._creating: Dict[str, threading.Lock] = {}
+        # Tenants whose schema hooks already ran in this process
+        self._prepared: Set[str] = set()
+
+    def get_engine(self, tenant: str) -> Engine:
+        """
+        Returns the engine of a tenant, creating it on first use.
+
+        Newly created engines are passed to every callable in :attr:`hooks`
+        (e.g. tracing instrumentation), and the first engine of a tenant in this
+        process also to every callable in :attr:`schema_hooks` (e.g. table creation),
+        which is not repeated when an evicted engine is created again.
+
+        :param tenant: Tenant name.
+        :return: The tenant's engine.
+        :raises UnknownTenantError: If the tenant has no configured database.
+        """
+        if not isinstance(tenant, str) or tenant not in self.databases:
+            raise UnknownTenantError(tenant)
+
+        with self._lock:
+            evicted = self._evict(time.monotonic())
+            tenant_engine = self._touch(tenant)
+            creating = self._creating.setdefault(tenant, threading.Lock())
+        self._dispose(evicted)
+        if tenant_engine is not None:
+            return tenant_engine
+
+        with creating:
+            with self._lock:
+                tenant_engine = self._touch(tenant)
+            if tenant_engine is not None:
+                return tenant_engine
+
+            tenant_engine = make_engine(self.databases[tenant])
+            try:
+                for hook in self.hooks:
+                    hook(tenant_engine)
+                if tenant not in self._prepared:
+                    for hook in self.schema_hooks:
+                        hook(tenant_engine)
+                    self._prepared.add(tenant)
+            except BaseException:
+                tenant_engine.dispose()
+                raise
+
+            with self._lock:
+                self._engines[tenant] = tenant_engine
+                self._last_used[tenant] = time.monotonic()
+                evicted = self._evict_over_limit()
+        self._dispose(evicted)
+        return tenant_engine
+
+    def session(self, tenant: Optional[str]) -> Session:
+        """
+        Opens a session on the tenant's database.
+
+        :param tenant: Tenant name, None for the default database.
+        :return: New database session.
+        :raises UnknownTenantError: If the tenant has no configured database.
+        """
+        if tenant is None:
+            return SessionLocal()
+        return SessionLocal(bind=self.get_engine(tenant))
+
+    def dispose_all(self) -> None:
+        """Disposes all tenant engines."""
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+            self._last_used.clear()
+        for old_engine in engines:
+            old_engine.dispose()
+
+    def _touch(self, tenant: str) -> Optional[Engine]:
+        tenant_engine = self._engines.get(tenant)
+        if tenant_engine is not None:
+            self._engines.move_to_end(tenant)
+            self._last_used[tenant] = time.monotonic()
+        return tenant_engine
+
+    @staticmethod
+    def _dispose(engines: List[Engine]) -> None:
+        for old_engine in engines:
+            old_engine.dispose()
+
+    def _evict(self, now: float) -> List[Engine]:
+        idle = [t for t, used in self._last_used.items() if now - used > self.idle_seconds]
+        return [self._remove(t) for t in idle]
+
+    def _evict_over_limit(self) -> List[Engine]:
+        evicted = []
+        while len(self._engines) > self.max_engines:
+            oldest = next(iter(self._engines))
+            evicted.append(self._remove(oldest))
+        return evicted
+
+    def _remove(self, tenant: str) -> Engine:
+        self._last_used.pop(tenant, None)
+        return self._engines.pop(tenant)
+
+
+tenant_engines = TenantEngines(
+    get_settings().tenant_databases,
+    get_settings().tenant_max_engines,
+    get_settings().tenant_engine_idle_seconds,
+)
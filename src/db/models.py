@@ -1,8 +1,9 @@
 from __future__ import annotations
 import datetime
+from typing import Optional
 
-from sqlalchemy import Date, Column, ForeignKey, Integer, String, Boolean, DateTime
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy import Date, Column, ForeignKey, Integer, String, Boolean, DateTime, CheckConstraint, Index, func
+from sqlalchemy.orm import DeclarativeBase, Mapped, backref, mapped_column, relationship
 
 class Base(DeclarativeBase):
     """
@@ -46,6 +47,7 @@ class User(Base):
         "Meal",
         secondary="orders",
         back_populates="users",
+        passive_deletes=True,
     )
 
 class Meal(Base):
@@ -60,6 +62,8 @@ class Meal(Base):
     :type name: str
     :param date: Date when the meal is available.
     :type date: datetime.date
+    :param portions: Number of portions the kitchen cooks, None when orders are not limited.
+    :type portions: int | None
     :param users: List of users who have ordered this meal.
     :type users: list[src.db.models.User]
     """
@@ -68,12 +72,14 @@ class Meal(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     meal_number: Mapped[int] = mapped_column(Integer)
     name: Mapped[str] = mapped_column(String)
-    date: Mapped[datetime.date] = mapped_column(Date)
+    date: Mapped[datetime.date] = mapped_column(Date, index=True)
+    portions: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     users: Mapped[list["User"]] = relationship(
         "User",
         secondary="orders",
         back_populates="meals",
+        passive_deletes=True,
     )
 
 class Order(Base):
@@ -89,19 +95,82 @@ class Order(Base):
     :param status: Status of the order (True when available and false when withdrawn).
     :type status: bool
     :param withdrawed_at: Timestamp when the order was withdrawn.
-    :type withdrawed_at: datetime.datetime
+    :type withdrawed_at: datetime.datetime | None
+    :param updated_at: Timestamp of the last change, used by the incremental analytics export.
+    :type updated_at: datetime.datetime
     :param user: Relationship to the User model.
     :type user: src.db.models.User
     :param meal: Relationship to the Meal model.
     :type meal: src.db.models.Meal
     """
     __tablename__ = 'orders'
-    
+    # Covers a user's orders for the per-user order history
+    __table_args__ = (
+        Index("ix_orders_user_meal", "user_id", "meal_id", postgresql_include=["id", "status", "withdrawed_at"]),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
-    meal_id: Mapped[int] = mapped_column(ForeignKey('meals.id'))
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"))
+    meal_id: Mapped[int] = mapped_column(ForeignKey('meals.id', ondelete="CASCADE"))
     status: Mapped[bool] = mapped_column(Boolean)
-    withdrawed_at: Mapped[datetime.datetime] = mapped_column(DateTime)
+    withdrawed_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime)
+    updated_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime, server_default=func.now(), onupdate=func.now(), index=True
+    )
+
+    # Orders are removed by ON DELETE CASCADE in the database, never loaded for deletion
+    user: Mapped["User"] = relationship("User", backref=backref("orders", passive_deletes=True))
+    meal: Mapped["Meal"] = relationship("Meal", backref=backref("orders", passive_deletes=True))
+
+class MealPortionShard(Base):
+    """
+    Represents a share of the portions still available for a meal.
+
+    A meal's remaining portions are split across several rows so concurrent orders
+    reserve from different rows instead of queueing on a single row lock. The
+    remaining portions of a meal are the sum over its shards.
+
+    :param meal_id: ID of the meal.
+    :type meal_id: int
+    :param shard: Index of the shard within the meal.
+    :type shard: int
+    :param remaining: Portions still available in this shard.
+    :type remaining: int
+    """
+    __tablename__ = 'meal_portions'
+    __table_args__ = (CheckConstraint("remaining >= 0", name="ck_meal_portions_remaining"),)
+
+    meal_id: Mapped[int] = mapped_column(ForeignKey('meals.id', ondelete="CASCADE"), primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    remaining: Mapped[int] = mapped_column(Integer)
+
+class OrderArchive(Base):
+    """
+    Represents an order from a closed school year moved out of the hot ``orders`` table.
 
-    user: Mapped["User"] = relationship("User", backref="orders")
-    meal: Mapped["Meal"] = relationship("Meal", backref="orders")
+    Rows keep the ``id`` they had in ``orders`` so archived and current orders can be
+    read together in reports.
+
+    :param id: Identifier the order had in the ``orders`` table.
+    :type id: int
+    :param user_id: ID of the user who placed the order.
+    :type user_id: int
+    :param meal_id: ID of the meal that was ordered.
+    :type meal_id: int
+    :param status: Status of the order (True when available and false when withdrawn).
+    :type status: bool
+    :param withdrawed_at: Timestamp when the order was withdrawn.
+    :type withdrawed_at: datetime.datetime | None
+    :param archived_at: Timestamp when the order was moved to the archive.
+    :type archived_at: datetime.datetime
+    """
+    __tablename__ = 'orders_archive'
+    # Archived side of the per-user order history with include_archive
+    __table_args__ = (Index("ix_orders_archive_user_meal", "user_id", "meal_id"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"))
+    meal_id: Mapped[int] = mapped_column(ForeignKey('meals.id', ondelete="CASCADE"))
+    status: Mapped[bool] = mapped_column(Boolean)
+    withdrawed_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime)
+    archived_at: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.now())
@@ -0,0 +1,196 @@
+"""
+Per-route deadline budgets, database statement timeouts and cancellation on client disconnect.
+
+Every route handled by :class:`DeadlineRoute` gets a deadline from its budget
+(``ROUTE_TIMEOUTS`` overridden by ``Settings.route_timeouts``, otherwise
+``Settings.default_route_timeout``). When a session of the request begins a
+transaction, the time left is applied as ``SET LOCAL statement_timeout`` on
+Postgres, so a slow query is stopped by the database instead of holding a pool
+connection. Requests whose query timed out, or that waited too long for a pool
+connection, get a 504.
+
+While the request runs, the route also waits for the client to disconnect. If the
+scanner or browser gives up, the query in flight is cancelled on the server
+(``connection.cancel()``) and the connection goes back to the pool.
+"""
+import asyncio
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Optional
+import contextvars
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+from config import get_settings
+from tracing import TracedRoute
+from profiling import ProfiledRoute
+
+# Výchozí rozpočty pro trasy, kde čeká fronta u výdeje
+ROUTE_TIMEOUTS: Dict[str, float] = {
+    "GET /users/meals-info/{ISIC_id}": 2,
+    "POST /users/meals-info/batch": 5,
+    "POST /orders/": 3,
+    "PATCH /orders/{user_number}": 3,
+}
+
+# SQLSTATE of a statement stopped by statement_timeout or a cancel request
+QUERY_CANCELED = "57014"
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request starts a database transaction after its deadline passed."""
+
+
+class RequestDeadline:
+    """Deadline of one request and the database connection it is currently using."""
+
+    def __init__(self, deadline: float):
+        """
+        Initializes RequestDeadline.
+
+        :param deadline: Absolute ``time.monotonic()`` time the request must finish by.
+        """
+        self.deadline = deadline
+        self.cancelled = False
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        """
+        Returns the seconds left until the deadline.
+
+        :return: Seconds left, negative when the deadline has passed.
+        """
+        return self.deadline - time.monotonic()
+
+    def attach(self, dbapi_connection) -> None:
+        """
+        Remembers the DBAPI connection running the request's transaction.
+
+        :param dbapi_connection: The driver connection, None when the transaction ended.
+        """
+        with self._lock:
+            self._connection = dbapi_connection
+
+    def cancel(self) -> None:
+        """Cancels the statement in flight, if the driver supports it."""
+        with self._lock:
+            self.cancelled = True
+            if self._connection is not None and hasattr(self._connection, "cancel"):
+                self._connection.cancel()
+
+
+_current_deadline: contextvars.ContextVar[Optional[RequestDeadline]] = contextvars.ContextVar("current_deadline", default=None)
+_stats: Counter = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_deadline_stats() -> Dict[str, int]:
+    """
+    Returns how many requests timed out or were cancelled because the client disconnected.
+
+    :return: Counters ``timeouts``, ``pool_timeouts`` and ``cancelled``.
+    """
+    with _stats_lock:
+        return {name: _stats[name] for name in ("timeouts", "pool_timeouts", "cancelled")}
+
+
+def route_budget(method: str, path: str) -> float:
+    """
+    Returns the deadline budget of a route.
+
+    :param method: HTTP method.
+    :param path: Path format of the route, e.g. ``/orders/{order_id}``.
+    :return: Budget in seconds.
+    """
+    settings = get_settings()
+    key = f"{method} {path}"
+    if key in settings.route_timeouts:
+        return settings.route_timeouts[key]
+    return ROUTE_TIMEOUTS.get(key, settings.default_route_timeout)
+
+
+@event.listens_for(Session, "after_begin")
+def _apply_statement_timeout(session, transaction, connection):
+    state = _current_deadline.get()
+    if state is None or transaction.parent is not None:
+        return
+    remaining = state.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(int(remaining * 1000), 1)}")
+    state.attach(connection.connection.dbapi_connection)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _detach_connection(session, transaction):
+    state = _current_deadline.get()
+    if state is not None and transaction.parent is None:
+        state.attach(None)
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+def _retrieve_result(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()
+
+
+class DeadlineRoute(TracedRoute, ProfiledRoute):
+    """Traced, profiled route enforcing the route's deadline budget and cancelling work of disconnected clients."""
+
+    def get_route_handler(self) -> Callable:
+        """
+        Wraps the route handler with the deadline and disconnect handling.
+
+        :return: The wrapped route handler.
+        """
+        handler = super().get_route_handler()
+        budgets = {method: route_budget(method, self.path_format) for method in self.methods}
+
+        async def deadline_handler(request):
+            # Tělo se načte předem, další receive() pak čeká jen na odpojení klienta
+            await request.body()
+            state = RequestDeadline(time.monotonic() + budgets[request.method])
+            token = _current_deadline.set(state)
+            handler_task = asyncio.ensure_future(handler(request))
+            disconnect_task = asyncio.ensure_future(_wait_for_disconnect(request))
+            _current_deadline.reset(token)
+
+            try:
+                await asyncio.wait({handler_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                disconnect_task.cancel()
+
+            if not handler_task.done():
+                # Klient to vzdal, zrušit rozpracovaný dotaz
+                state.cancel()
+                handler_task.add_done_callback(_retrieve_result)
+                _count("cancelled")
+                return Response(status_code=499)
+
+            try:
+                return handler_task.result()
+            except OperationalError as error:
+                if getattr(error.orig, "pgcode", None) != QUERY_CANCELED:
+                    raise
+                _count("timeouts")
+            except DeadlineExceeded:
+                _count("timeouts")
+            except PoolTimeoutError:
+                _count("pool_timeouts")
+            return JSONResponse(status_code=504, content={"detail": "Request timed out"})
+
+        return deadline_handler
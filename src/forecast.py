@@ -0,0 +1,210 @@
+"""
+Demand forecast per weekday and meal number.
+
+The order history of all school years (``orders`` and ``orders_archive``) is
+aggregated by the database into one row per meal, loaded into NumPy arrays in a
+single query and reduced with weighted ``bincount`` into expected orders and
+withdrawal (pick-up) rate for every weekday and meal number. Recent weeks weigh
+more: the weight of a day halves every ``Settings.forecast_half_life_days``.
+
+The forecast is cached per database and recomputed by the first request of a new
+day, so the kitchen sees a nightly refreshed forecast at the cost of a dictionary
+lookup. Requires NumPy from the optional ``analytics`` dependency group.
+"""
+import datetime
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Tuple
+from sqlalchemy import func, select, union_all
+from sqlalchemy.orm import Session
+from config import get_settings
+from db.models import Meal, Order, OrderArchive
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WEEKDAYS = 7
+MEAL_NUMBERS = 3
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("The demand forecast needs numpy, install it with 'poetry install --with analytics'.")
+
+
+def load_history(db: Session) -> Dict[str, "np.ndarray"]:
+    """
+    Load the number of orders and withdrawn orders of every past meal into arrays.
+
+    Only orders that were not cancelled count. Meals without any order are included
+    with zero orders.
+
+    :param db: Database session.
+    :type db: Session
+    :return: Arrays ``date`` (datetime64[D]), ``meal_number``, ``ordered`` and ``withdrawn``, one item per meal.
+    :rtype: Dict[str, numpy.ndarray]
+    """
+    _require_numpy()
+    # Cancelled orders are no demand, the kitchen does not cook them
+    all_orders = union_all(
+        select(Order.meal_id, Order.withdrawed_at).where(Order.status.is_not(False)),
+        select(OrderArchive.meal_id, OrderArchive.withdrawed_at).where(OrderArchive.status.is_not(False))
+    ).subquery()
+    rows = db.execute(
+        select(
+            Meal.date,
+            Meal.meal_number,
+            func.count(all_orders.c.meal_id),
+            func.count(all_orders.c.withdrawed_at)
+        )
+        .outerjoin(all_orders, all_orders.c.meal_id == Meal.id)
+        .where(Meal.date < datetime.date.today())
+        .group_by(Meal.id, Meal.date, Meal.meal_number)
+    ).all()
+
+    if not rows:
+        empty = np.array([], dtype=np.int64)
+        return {"date": empty.astype("datetime64[D]"), "meal_number": empty, "ordered": empty, "withdrawn": empty}
+    dates, meal_numbers, ordered, withdrawn = zip(*rows)
+    return {
+        "date": np.array(dates, dtype="datetime64[D]"),
+        "meal_number": np.array(meal_numbers, dtype=np.int64),
+        "ordered": np.array(ordered, dtype=np.float64),
+        "withdrawn": np.array(withdrawn, dtype=np.float64),
+    }
+
+
+def compute_forecast(history: Dict[str, "np.ndarray"], today: datetime.date, half_life_days: float) -> Dict[str, "np.ndarray"]:
+    """
+    Compute expected orders and withdrawal rate per weekday and meal number.
+
+    :param history: Arrays as returned by :func:`load_history`.
+    :type history: Dict[str, numpy.ndarray]
+    :param today: Day the weights of the history are relative to.
+    :type today: datetime.date
+    :param half_life_days: Age in days at which a meal counts half.
+    :type half_life_days: float
+    :return: ``demand``, ``withdrawal_rate`` and ``meals`` (number of past meals used), each of shape (7, 3)
+        indexed by weekday (Monday = 0) and meal number - 1. Cells without history are NaN.
+    :rtype: Dict[str, numpy.ndarray]
+    """
+    _require_numpy()
+    dates = history["date"].astype(np.int64)
+    # 1970-01-01 byl čtvrtek, pondělí = 0
+    weekday = (dates + 3) % WEEKDAYS
+    valid = (history["meal_number"] >= 1) & (history["meal_number"] <= MEAL_NUMBERS)
+    cell = (weekday * MEAL_NUMBERS + history["meal_number"] - 1)[valid]
+
+    age = (np.datetime64(today, "D").astype(np.int64) - dates)[valid]
+    weight = np.exp2(-age / half_life_days)
+    ordered = history["ordered"][valid]
+    withdrawn = history["withdrawn"][valid]
+
+    cells = WEEKDAYS * MEAL_NUMBERS
+    weight_sum = np.bincount(cell, weights=weight, minlength=cells)
+    ordered_sum = np.bincount(cell, weights=weight * ordered, minlength=cells)
+    withdrawn_sum = np.bincount(cell, weights=weight * withdrawn, minlength=cells)
+    meals = np.bincount(cell, minlength=cells)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        demand = np.where(weight_sum > 0, ordered_sum / weight_sum, np.nan)
+        withdrawal_rate = np.where(ordered_sum > 0, withdrawn_sum / ordered_sum, np.nan)
+
+    shape = (WEEKDAYS, MEAL_NUMBERS)
+    return {
+        "demand": demand.reshape(shape),
+        "withdrawal_rate": withdrawal_rate.reshape(shape),
+        "meals": meals.reshape(shape),
+    }
+
+
+class ForecastCache:
+    """
+    Forecast per database, recomputed once a day.
+
+    The history is loaded outside the lock. Concurrent requests for a database whose
+    forecast is being computed wait for that computation instead of starting their
+    own, and requests for other databases are not blocked by it.
+    """
+
+    def __init__(self):
+        """Initializes ForecastCache with no forecasts."""
+        self._forecasts: Dict[str, Tuple[datetime.date, Dict[str, Any]]] = {}
+        self._pending: Dict[Tuple[str, datetime.date], Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, db: Session) -> Dict[str, Any]:
+        """
+        Returns the forecast of the session's database, computing it if it is from a previous day.
+
+        :param db: Database session.
+        :return: Forecast as returned by :func:`compute_forecast`.
+        """
+        key = str(db.get_bind().url)
+        today = datetime.date.today()
+        with self._lock:
+            cached = self._forecasts.get(key)
+            if cached is not None and cached[0] == today:
+                return cached[1]
+            pending = self._pending.get((key, today))
+            owner = pending is None
+            if owner:
+                pending = self._pending[(key, today)] = Future()
+
+        if not owner:
+            return pending.result()
+
+        try:
+            forecast = compute_forecast(load_history(db), today, get_settings().forecast_half_life_days)
+        except BaseException as error:
+            with self._lock:
+                del self._pending[(key, today)]
+            pending.set_exception(error)
+            raise
+        with self._lock:
+            self._forecasts[key] = (today, forecast)
+            del self._pending[(key, today)]
+        pending.set_result(forecast)
+        return forecast
+
+    def clear(self) -> None:
+        """Drops all cached forecasts, the next request recomputes them."""
+        with self._lock:
+            self._forecasts.clear()
+
+
+forecast_cache = ForecastCache()
+
+
+def get_forecast(db: Session, day: datetime.date) -> List[Dict[str, Any]]:
+    """
+    Retrieve the expected orders and withdrawals of every meal number on a day.
+
+    :param db: Database session.
+    :type db: Session
+    :param day: Day to forecast.
+    :type day: datetime.date
+    :return: One entry per meal number with expected orders, withdrawal rate and expected withdrawals.
+        Values are None when there is no history for the weekday and meal number.
+    :rtype: List[Dict[str, Any]]
+
+    Example:
+        >>> get_forecast(db, datetime.date(2025, 3, 14))
+    """
+    forecast = forecast_cache.get(db)
+    weekday = day.weekday()
+    result = []
+    for meal_number in range(1, MEAL_NUMBERS + 1):
+        demand = forecast["demand"][weekday, meal_number - 1]
+        rate = forecast["withdrawal_rate"][weekday, meal_number - 1]
+        result.append({
+            "date": day,
+            "meal_number": meal_number,
+            "expected_orders": None if np.isnan(demand) else round(float(demand), 1),
+            "withdrawal_rate": None if np.isnan(rate) else round(float(rate), 3),
+            "expected_withdrawals": None if np.isnan(demand) or np.isnan(rate) else round(float(demand * rate), 1),
+            "history_meals": int(forecast["meals"][weekday, meal_number - 1]),
+        })
+    return result
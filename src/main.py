@@ -1,8 +1,13 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
-from db.database import engine
+from db.database import engine, tenant_engines
 from db.models import Base
 from routers import items
+from profiling import ProfilingMiddleware, instrument_threadpool, profiling_enabled
+from capture import CaptureMiddleware, capture_enabled
+from tracing import configure_from_settings, instrument_engine
+import statements
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Depends, FastAPI 
 from fastapi.security import HTTPBearer 
@@ -10,15 +15,54 @@ from fastapi.security import HTTPBearer
 # Scheme for the Authorization header
 token_auth_scheme = HTTPBearer()
 
-# Create the database tables
-Base.metadata.create_all(bind=engine)
+# Trace requests, crud calls and SQL statements when an exporter is configured
+configure_from_settings()
 
-app = FastAPI()
+def setup_engine(db_engine):
+    """
+    Instruments an engine.
+
+    Applied to the default engine and to every tenant engine when it is created.
+
+    :param db_engine: The engine to set up.
+    """
+    instrument_engine(db_engine)
+    # Count compiled statement cache hits, see /admin/statement-cache
+    statements.instrument_engine(db_engine)
+
+def create_tables(db_engine):
+    """
+    Creates the database tables.
+
+    Applied to the default engine and once per tenant, not to engines recreated after eviction.
+
+    :param db_engine: The engine of the database.
+    """
+    Base.metadata.create_all(bind=db_engine)
+
+setup_engine(engine)
+create_tables(engine)
+tenant_engines.hooks.append(setup_engine)
+tenant_engines.schema_hooks.append(create_tables)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Closes the database connections of the worker once it has drained its requests.
+
+    :param app: The application.
+    """
+    yield
+    tenant_engines.dispose_all()
+    engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Include routers
 app.include_router(items.router_meals)
 app.include_router(items.router_orders)
 app.include_router(items.router_user)
+app.include_router(items.router_admin)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +71,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+# Only installed when enabled so a disabled profiler adds no per-request work
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+    instrument_threadpool()
+if capture_enabled():
+    app.add_middleware(CaptureMiddleware)
     
+# Development server, use server.py in production
 if __name__ == '__main__':
     uvicorn.run(app, host="127.0.0.1", port=8000)
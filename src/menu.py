@@ -0,0 +1,135 @@
+"""
+Cache of pre-serialized weekly menu payloads.
+
+The menu calendar is served per ISO week. The JSON of a week is built once and
+kept as bytes, so a calendar request for cached weeks only joins byte strings
+without touching the database or pydantic. Crud functions writing meals
+invalidate the week of the changed meal; entries also expire after
+``Settings.menu_cache_ttl_seconds`` so workers that did not see the write (other
+server processes) catch up. A week invalidated while it was being built is not
+stored, so a payload read before a write never outlives it.
+"""
+import datetime
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+from config import get_settings
+
+
+def week_start(day: datetime.date) -> datetime.date:
+    """
+    Return the Monday of the ISO week containing the given day.
+
+    :param day: Any day of the week.
+    :type day: datetime.date
+    :return: Monday of the week.
+    :rtype: datetime.date
+    """
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def weeks_between(date_from: datetime.date, date_to: datetime.date) -> List[datetime.date]:
+    """
+    Return the Mondays of all ISO weeks overlapping a date range.
+
+    :param date_from: First day of the range.
+    :type date_from: datetime.date
+    :param date_to: Last day of the range.
+    :type date_to: datetime.date
+    :return: Mondays in ascending order.
+    :rtype: List[datetime.date]
+    """
+    monday = week_start(date_from)
+    weeks = []
+    while monday <= date_to:
+        weeks.append(monday)
+        monday += datetime.timedelta(days=7)
+    return weeks
+
+
+def serialize_week(monday: datetime.date, meals: Iterable) -> bytes:
+    """
+    Build the JSON payload of one week, meals grouped by date and meal number.
+
+    :param monday: Monday of the week.
+    :type monday: datetime.date
+    :param meals: Meals dated within the week.
+    :type meals: Iterable[src.db.models.Meal]
+    :return: UTF-8 encoded JSON object.
+    :rtype: bytes
+    """
+    year, week, _ = monday.isocalendar()
+    days: Dict[str, Dict[str, dict]] = {}
+    for meal in meals:
+        days.setdefault(meal.date.isoformat(), {})[str(meal.meal_number)] = {
+            "id": meal.id,
+            "meal_number": meal.meal_number,
+            "name": meal.name,
+            "date": meal.date.isoformat(),
+            "portions": meal.portions,
+        }
+    payload = {"week": f"{year}-W{week:02d}", "monday": monday.isoformat(), "days": days}
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class MenuCalendarCache:
+    """Serialized week payloads per database and ISO week."""
+
+    def __init__(self, ttl: float):
+        """
+        Initializes MenuCalendarCache.
+
+        :param ttl: Seconds a cached week is served before it is rebuilt.
+        """
+        self.ttl = ttl
+        self._weeks: Dict[Tuple[str, datetime.date], Tuple[float, bytes]] = {}
+        # Bumped by every invalidation, a build only stores its payload when unchanged
+        self._generations: Dict[Tuple[str, datetime.date], int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get_week(self, database: str, monday: datetime.date, build: Callable[[], bytes]) -> bytes:
+        """
+        Returns the payload of a week, building it when missing or expired.
+
+        :param database: Key of the database the week belongs to.
+        :param monday: Monday of the week.
+        :param build: Builds the payload of the week.
+        :return: The week payload.
+        """
+        key = (database, monday)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._weeks.get(key)
+            generation = (self._epoch, self._generations.get(key, 0))
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached[1]
+
+        payload = build()
+        with self._lock:
+            if generation == (self._epoch, self._generations.get(key, 0)):
+                self._weeks[key] = (now, payload)
+        return payload
+
+    def invalidate(self, database: str, day: datetime.date) -> None:
+        """
+        Drops the cached week containing a day.
+
+        :param database: Key of the database the day belongs to.
+        :param day: Day whose week changed.
+        """
+        key = (database, week_start(day))
+        with self._lock:
+            self._weeks.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self) -> None:
+        """Drops all cached weeks."""
+        with self._lock:
+            self._weeks.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+
+menu_cache = MenuCalendarCache(get_settings().menu_cache_ttl_seconds)
@@ -0,0 +1,312 @@
+"""
+Opt-in per-request profiler.
+
+A request is profiled when it carries the ``X-Profile`` header matching
+``Settings.profiling_token`` or when it is picked by sampling with
+``Settings.profiling_sample_rate``. While a profiled request is handled by its route,
+the threads working for it are attached to the shared :data:`sampler`: the event loop
+thread, sampled only while it runs the request's own task (body parsing, pydantic
+validation, async dependencies such as the JWT check), and every threadpool call made
+for the request (sync dependencies, the endpoint, ``response_model`` serialization).
+That one background thread samples only the attached threads, so a profile holds the
+request's own work and never the stacks of concurrent requests, and the sampler
+sleeps while no profiled request is running. Finished profiles are kept in memory and
+served by the ``/admin/profiles`` endpoints.
+
+The middleware is only installed, and routes and the threadpool only instrumented,
+when profiling is enabled, so a disabled profiler costs nothing on the hot path.
+"""
+import asyncio
+import contextvars
+import functools
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+import fastapi.dependencies.utils
+import fastapi.routing
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from config import get_settings
+
+PROFILE_HEADER = b"x-profile"
+
+# Stack counts of the profiled request being handled, None when it is not profiled
+_current_profile: contextvars.ContextVar[Optional[Counter]] = contextvars.ContextVar("current_profile", default=None)
+
+
+class StackSampler:
+    """Background thread periodically sampling the stacks of the attached threads."""
+
+    def __init__(self, interval: float):
+        """
+        Initializes StackSampler.
+
+        :param interval: Seconds between two samples.
+        """
+        self.interval = interval
+        # Attachment handle -> (thread ident, stacks, event loop, task)
+        self._attached: Dict[int, Tuple[int, Counter, Optional[asyncio.AbstractEventLoop], Optional[asyncio.Task]]] = {}
+        self._handles = itertools.count(1)
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def attach(self, thread_id: int, stacks: Counter, task: Optional[asyncio.Task] = None) -> int:
+        """
+        Starts sampling a thread, starting the sampling thread on first use.
+
+        :param thread_id: Ident of the thread working for a profiled request.
+        :param stacks: Sample counts per folded stack of that request.
+        :param task: For an event loop thread, the request's task; the thread is only
+            sampled while its loop runs that task, not other requests or the idle loop.
+        :return: Handle passed to :meth:`detach`.
+        """
+        loop = task.get_loop() if task is not None else None
+        with self._lock:
+            handle = next(self._handles)
+            self._attached[handle] = (thread_id, stacks, loop, task)
+            self._active.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        return handle
+
+    def detach(self, handle: int) -> None:
+        """
+        Stops sampling an attached thread; no more samples are added to its stacks afterwards.
+
+        :param handle: Handle returned by :meth:`attach`.
+        """
+        with self._lock:
+            self._attached.pop(handle, None)
+            if not self._attached:
+                self._active.clear()
+
+    def _run(self) -> None:
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._attached:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks, loop, task in self._attached.values():
+                    if task is not None and asyncio.current_task(loop) is not task:
+                        continue
+                    frame = frames.get(thread_id)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    if stack:
+                        stacks[";".join(reversed(stack))] += 1
+
+
+class ProfileStore:
+    """Bounded in-memory store of finished request profiles, oldest dropped first."""
+
+    def __init__(self, max_profiles: int):
+        """
+        Initializes ProfileStore.
+
+        :param max_profiles: Maximum number of profiles kept.
+        """
+        self._profiles: Deque[Dict[str, Any]] = deque(maxlen=max_profiles)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, method: str, path: str, status: Optional[int], duration: float, stacks: Counter) -> Dict[str, Any]:
+        """
+        Stores a finished profile.
+
+        :param method: HTTP method of the profiled request.
+        :param path: URL path of the profiled request.
+        :param status: Response status code, None if the request failed before responding.
+        :param duration: Wall time of the request in seconds.
+        :param stacks: Sample counts per folded stack.
+        :return: The stored profile.
+        """
+        with self._lock:
+            profile = {
+                "id": next(self._ids),
+                "method": method,
+                "path": path,
+                "status": status,
+                "started_at": time.time() - duration,
+                "duration_ms": round(duration * 1000, 3),
+                "samples": sum(stacks.values()),
+                "stacks": stacks,
+            }
+            self._profiles.append(profile)
+        return profile
+
+    def list(self) -> List[Dict[str, Any]]:
+        """
+        Returns a summary of all stored profiles, newest first.
+
+        :return: Profiles without their stack samples.
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        return [{k: v for k, v in p.items() if k != "stacks"} for p in reversed(profiles)]
+
+    def get(self, profile_id: int, limit: int = 50) -> Optional[Dict[str, Any]]:
+        """
+        Returns one profile with its per-function statistics and folded stacks.
+
+        :param profile_id: ID of the profile.
+        :param limit: Maximum number of functions and stacks returned.
+        :return: The profile, or None if it is unknown or was already dropped.
+        """
+        with self._lock:
+            profile = next((p for p in self._profiles if p["id"] == profile_id), None)
+        if profile is None:
+            return None
+
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in profile["stacks"].items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for function in set(frames):
+                total[function] += count
+
+        result = {k: v for k, v in profile.items() if k != "stacks"}
+        result["functions"] = [
+            {"function": function, "own": own[function], "total": count}
+            for function, count in total.most_common(limit)
+        ]
+        result["stacks"] = [f"{stack} {count}" for stack, count in profile["stacks"].most_common(limit)]
+        return result
+
+
+profile_store = ProfileStore(get_settings().profiling_max_profiles)
+sampler = StackSampler(get_settings().profiling_interval)
+
+
+def profiling_enabled() -> bool:
+    """
+    Tells whether the profiling middleware should be installed.
+
+    :return: True when profiling by header or by sampling is configured.
+    """
+    settings = get_settings()
+    return bool(settings.profiling_token) or settings.profiling_sample_rate > 0
+
+
+def profile_thread(func: Callable) -> Callable:
+    """
+    Wraps a function run in the threadpool so its worker thread is sampled while it works for a profiled request.
+
+    :param func: The function.
+    :return: The wrapped function, with the same signature.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stacks = _current_profile.get()
+        if stacks is None:
+            return func(*args, **kwargs)
+        handle = sampler.attach(threading.get_ident(), stacks)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.detach(handle)
+
+    return wrapper
+
+
+async def profiled_run_in_threadpool(func: Callable, *args, **kwargs) -> Any:
+    """
+    :func:`starlette.concurrency.run_in_threadpool` attaching the worker thread to profiled requests.
+
+    The threadpool copies the context of the request, so :func:`profile_thread` sees its profile.
+    """
+    return await run_in_threadpool(profile_thread(func), *args, **kwargs)
+
+
+def instrument_threadpool() -> None:
+    """
+    Makes FastAPI run sync dependencies, endpoints and response serialization through
+    :func:`profiled_run_in_threadpool`. Only called when profiling is enabled.
+    """
+    fastapi.routing.run_in_threadpool = profiled_run_in_threadpool
+    fastapi.dependencies.utils.run_in_threadpool = profiled_run_in_threadpool
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute sampling the event loop for its profiled requests when profiling is enabled."""
+
+    def get_route_handler(self) -> Callable:
+        """
+        Wraps the default route handler, so the event loop thread is sampled while it
+        runs the handler's task for a profiled request.
+
+        :return: The wrapped route handler.
+        """
+        handler = super().get_route_handler()
+        if not profiling_enabled():
+            return handler
+
+        async def profiled_handler(request):
+            stacks = _current_profile.get()
+            if stacks is None:
+                return await handler(request)
+            handle = sampler.attach(threading.get_ident(), stacks, asyncio.current_task())
+            try:
+                return await handler(request)
+            finally:
+                sampler.detach(handle)
+
+        return profiled_handler
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests selected by header or by sampling."""
+
+    def __init__(self, app):
+        """
+        Initializes ProfilingMiddleware from the application settings.
+
+        :param app: The wrapped ASGI application.
+        """
+        self.app = app
+        settings = get_settings()
+        self.token = settings.profiling_token.encode()
+        self.sample_rate = settings.profiling_sample_rate
+        self.store = profile_store
+
+    def _should_profile(self, scope) -> bool:
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER and hmac.compare_digest(value, self.token):
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stacks: Counter = Counter()
+        token = _current_profile.set(stacks)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            self.store.add(scope["method"], scope["path"], status, time.perf_counter() - start, stacks)
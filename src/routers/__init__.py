@@ -1,3 +1,3 @@
-from .items import router_user, router_meals, router_orders
+from .items import router_user, router_meals, router_orders, router_admin
 
-__all__ = ["router_user", "router_meals", "router_orders"]
\ No newline at end of file
+__all__ = ["router_user", "router_meals", "router_orders", "router_admin"]
\ No newline at end of file
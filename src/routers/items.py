@@ -1,17 +1,26 @@
-from datetime import date
-from typing import Any, Dict, List
-from fastapi import APIRouter, Depends, HTTPException, Query, Security
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, Security
 from sqlalchemy.orm import Session
-from db.database import SessionLocal
-from utils import VerifyToken
+from db.database import UnknownTenantError, tenant_engines
+from utils import VerifyToken, resolve_tenant
+from profiling import profile_store
+from deadlines import DeadlineRoute, get_deadline_stats
+from statements import get_cache_stats
+from forecast import get_forecast
+import compact
+from config import get_settings
 from crud import (
     create_meal, create_order, create_user, get_all_meals, get_all_orders, get_all_users, get_meal_by_id, get_order_by_id,
     get_user_by_number, get_user_meal_info, update_meal_by_id, update_order, update_user,
-    delete_meal_by_id, delete_order, delete_user_by_ISIC
+    delete_meal_by_id, delete_order, delete_user_by_ISIC, archive_orders, get_users_meal_info,
+    delete_meals_by_date_range, patch_user, patch_meal, patch_order, get_remaining_portions, get_menu_calendar,
+    search_users, cancel_orders, withdraw_orders, delete_orders, get_user_orders
 )
 from schemas import (
     Order, User, Meal, MealCreate, OrderCreate, UserCreate,
-    UserUpdate, MealUpdate, OrderUpdate
+    UserUpdate, MealUpdate, OrderUpdate, MealInfoBatch, UserPatch, MealPatch, OrderPatch,
+    UserSearchResult, OrderBulkFilter, UserOrdersPage
 )
 
 """
@@ -21,16 +30,22 @@ Each router is registered with appropriate endpoints using FastAPI's APIRouter.
 
 auth = VerifyToken()
 
-router_user = APIRouter(prefix="/users", tags=["users"])
+router_user = APIRouter(prefix="/users", tags=["users"], route_class=DeadlineRoute)
 
-def get_db():
+def get_db(request: Request):
     """
-    Dependency to get a new database session.
+    Dependency to get a new database session on the database of the request's tenant.
     
+    :param request: The incoming request, used to resolve the tenant.
+    :type request: Request
+    :raises HTTPException: If the tenant has no configured database.
     :yield: SQLAlchemy database session.
     :rtype: Session
     """
-    db = SessionLocal()
+    try:
+        db = tenant_engines.session(resolve_tenant(request))
+    except UnknownTenantError as error:
+        raise HTTPException(status_code=404, detail=f"Unknown tenant '{error.args[0]}'")
     try:
         yield db
     finally:
@@ -63,6 +78,30 @@ def get_all_users_endpoint(db: Session = Depends(get_db)):
     users = get_all_users(db=db)
     return users
 
+@router_user.get("/search", response_model=List[UserSearchResult])
+def search_users_endpoint(
+    q: str = Query(..., min_length=2, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db)
+):
+    """
+    Search users by name and surname, ignoring case and diacritics.
+
+    Declared before ``/{user_number}`` so that ``search`` is not taken for a user number.
+
+    :param q: Search text, a prefix or a misspelled name.
+    :type q: str
+    :param limit: Maximum number of results.
+    :type limit: int
+    :param db: Database session.
+    :type db: Session
+    :return: Best matching users, best first.
+    :rtype: List[UserSearchResult]
+
+    Example:
+        GET /users/search?q=novak&limit=5
+    """
+    return search_users(db=db, query=q, limit=limit)
 
 @router_user.get("/{user_number}", response_model=User)
 def get_user_endpoint(user_number: str, db: Session = Depends(get_db)):
@@ -84,6 +123,43 @@ def get_user_endpoint(user_number: str, db: Session = Depends(get_db)):
 
 
 
+@router_user.get("/{user_number}/orders", response_model=UserOrdersPage)
+def get_user_orders_endpoint(
+    user_number: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    include_archive: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve a user's past and upcoming orders with their meals, newest meal date first.
+
+    Orders of closed school years are only listed with ``include_archive``.
+
+    :param user_number: The unique number identifying the user.
+    :type user_number: int
+    :param cursor: ``next_cursor`` of the previous page, omitted for the first page.
+    :type cursor: str | None
+    :param limit: Maximum number of orders on the page.
+    :type limit: int
+    :param include_archive: Whether to include archived orders of closed school years.
+    :type include_archive: bool
+    :param db: Database session.
+    :type db: Session
+    :return: One page of orders and the cursor of the next page.
+    :rtype: UserOrdersPage
+    :raises HTTPException: If the user is not found or the cursor is malformed.
+
+    Example:
+        GET /users/1023/orders?limit=10
+        GET /users/1023/orders?limit=10&cursor=MjAyNS0wMy0xNHw0Mg
+        GET /users/1023/orders?include_archive=true
+    """
+    page = get_user_orders(db=db, user_number=user_number, cursor=cursor, limit=limit, include_archive=include_archive)
+    if page is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return page
+
 @router_user.put("/{user_number}", response_model=User)
 def update_user_endpoint(user_number: str, user_update: UserUpdate, db: Session = Depends(get_db)):
     """
@@ -100,6 +176,26 @@ def update_user_endpoint(user_number: str, user_update: UserUpdate, db: Session
     """
     return update_user(db=db, user_number=user_number, user_update=user_update)
 
+@router_user.patch("/{user_number}", response_model=User)
+def patch_user_endpoint(user_number: int, user_patch: UserPatch, db: Session = Depends(get_db)):
+    """
+    Partially update an existing user, only the supplied fields are changed.
+    
+    :param user_number: Internal user number of the user to update.
+    :type user_number: int
+    :param user_patch: Fields to change.
+    :type user_patch: UserPatch
+    :param db: Database session.
+    :type db: Session
+    :raises HTTPException: If user is not found.
+    :return: Updated user object.
+    :rtype: User
+    """
+    user = patch_user(db=db, user_number=user_number, user_patch=user_patch)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
 @router_user.delete("/{user_number}")
 def delete_user_endpoint(user_number: str, db: Session = Depends(get_db)):
     """
@@ -116,9 +212,12 @@ def delete_user_endpoint(user_number: str, db: Session = Depends(get_db)):
     return {"message": "User deleted successfully!"}
 
 @router_user.get("/meals-info/{ISIC_id}")
-def get_meal_info_by_ISIC(ISIC_id: str, db: Session = Depends(get_db)) -> Dict[str, Any]:
+def get_meal_info_by_ISIC(ISIC_id: str, request: Request, response: Response, db: Session = Depends(get_db)) -> Dict[str, Any]:
     """
     Retrieve user and meal information based on ISIC_id.
+
+    Answers with MessagePack or CBOR when asked for in the ``Accept`` header, see :mod:`compact`,
+    a 404 as well.
     
     :param ISIC_id: The ISIC ID of the user.
     :type ISIC_id: str
@@ -129,10 +228,49 @@ def get_meal_info_by_ISIC(ISIC_id: str, db: Session = Depends(get_db)) -> Dict[s
 
     Example:
         GET /users/123456789
+        GET /users/123456789 (Accept: application/msgpack)
+    """
+    media_type = compact.negotiate(request.headers.get("accept", ""))
+    try:
+        info = get_user_meal_info(db=db, isic_id=ISIC_id)
+    except HTTPException as error:
+        payload = compact.error_payload(error.detail) if media_type is not None else None
+        if payload is None:
+            raise
+        return Response(compact.encode(media_type, payload), status_code=error.status_code, media_type=media_type, headers={"Vary": "Accept"})
+    if media_type is not None:
+        return Response(compact.encode(media_type, compact.meal_info_payload(info)), media_type=media_type, headers={"Vary": "Accept"})
+    response.headers["Vary"] = "Accept"
+    return info
+
+@router_user.post("/meals-info/batch")
+def get_meal_info_batch(
+    batch: MealInfoBatch, request: Request, response: Response, db: Session = Depends(get_db)
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Retrieve today's user and meal information for many ISIC ids in one request.
+
+    Used by terminals syncing scans queued while offline and by the roll-call screen.
+    Answers with MessagePack or CBOR when asked for in the ``Accept`` header, see :mod:`compact`.
+    
+    :param batch: ISIC IDs to look up.
+    :type batch: MealInfoBatch
+    :param db: Database session.
+    :type db: Session
+    :return: Found meal infos and not found ISIC IDs with the reason.
+    :rtype: Dict[str, List[Dict[str, Any]]]
+
+    Example:
+        POST /users/meals-info/batch {"ISIC_ids": ["123456789", "987654321"]}
     """
-    return get_user_meal_info(db=db, isic_id=ISIC_id)
+    result = get_users_meal_info(db=db, isic_ids=batch.ISIC_ids)
+    media_type = compact.negotiate(request.headers.get("accept", ""))
+    if media_type is not None:
+        return Response(compact.encode(media_type, compact.batch_payload(result)), media_type=media_type, headers={"Vary": "Accept"})
+    response.headers["Vary"] = "Accept"
+    return result
 
-router_meals = APIRouter(prefix="/meals", tags=["meals"])
+router_meals = APIRouter(prefix="/meals", tags=["meals"], route_class=DeadlineRoute)
 
 @router_meals.post("/", response_model=Meal)
 def create_meal_endpoint(meal: MealCreate, db: Session = Depends(get_db)):
@@ -162,6 +300,63 @@ def get_all_meals_endpoint(db: Session = Depends(get_db)):
     return meals
 
 
+@router_meals.get("/calendar")
+def get_menu_calendar_endpoint(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve the menu grouped by date and meal number for all weeks overlapping a date range.
+
+    The range is widened to whole ISO weeks, whose pre-serialized payloads are cached.
+    
+    :param date_from: First day, defaults to the Monday of this week.
+    :type date_from: date | None
+    :param date_to: Last day, defaults to the Sunday of next week.
+    :type date_to: date | None
+    :param db: Database session.
+    :type db: Session
+    :raises HTTPException: If the range is reversed or longer than the allowed number of weeks.
+    :return: JSON with ``from``, ``to`` and ``weeks``; each week has ``days`` keyed by date and meal number.
+    :rtype: Response
+
+    Example:
+        GET /meals/calendar?from=2025-01-13&to=2025-01-26
+    """
+    today = date.today()
+    if date_from is None:
+        date_from = today - timedelta(days=today.weekday())
+    if date_to is None:
+        date_to = date_from - timedelta(days=date_from.weekday()) + timedelta(days=13)
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (date_to - date_from).days >= get_settings().menu_calendar_max_weeks * 7:
+        raise HTTPException(status_code=400, detail=f"Range must not exceed {get_settings().menu_calendar_max_weeks} weeks")
+    return Response(content=get_menu_calendar(db=db, date_from=date_from, date_to=date_to), media_type="application/json")
+
+@router_meals.get("/forecast")
+def get_forecast_endpoint(day: Optional[date] = None, db: Session = Depends(get_db)) -> List[Dict[str, Any]]:
+    """
+    Retrieve the expected orders and withdrawals of every meal number on a day.
+
+    The forecast is computed from the order history once a day and served from memory.
+    
+    :param day: Day to forecast, defaults to tomorrow.
+    :type day: date | None
+    :param db: Database session.
+    :type db: Session
+    :raises HTTPException: If the forecast dependencies are not installed.
+    :return: One entry per meal number.
+    :rtype: List[Dict[str, Any]]
+    """
+    if day is None:
+        day = date.today() + timedelta(days=1)
+    try:
+        return get_forecast(db=db, day=day)
+    except RuntimeError as error:
+        raise HTTPException(status_code=503, detail=str(error))
+
 @router_meals.get("/{meal_id}", response_model=Meal)
 def get_meal_endpoint(meal_id: int, db: Session = Depends(get_db)):
     """
@@ -180,6 +375,24 @@ def get_meal_endpoint(meal_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Meal not found")
     return meal
 
+@router_meals.get("/{meal_id}/portions")
+def get_meal_portions_endpoint(meal_id: int, db: Session = Depends(get_db)) -> Dict[str, Any]:
+    """
+    Retrieve how many portions of a meal can still be ordered.
+    
+    :param meal_id: Meal ID.
+    :type meal_id: int
+    :param db: Database session.
+    :type db: Session
+    :raises HTTPException: If meal is not found.
+    :return: Capacity of the meal and remaining portions, both None when orders are not limited.
+    :rtype: Dict[str, Any]
+    """
+    meal = get_meal_by_id(db=db, meal_id=meal_id)
+    if meal is None:
+        raise HTTPException(status_code=404, detail="Meal not found")
+    return {"meal_id": meal.id, "portions": meal.portions, "remaining": get_remaining_portions(db=db, meal_id=meal_id)}
+
 @router_meals.put("/{meal_id}", response_model=Meal)
 def update_meal_endpoint(meal_id: int, meal_update: MealUpdate, db: Session = Depends(get_db)):
     """
@@ -196,6 +409,26 @@ def update_meal_endpoint(meal_id: int, meal_update: MealUpdate, db: Session = De
     """
     return update_meal_by_id(db=db, meal_id=meal_id, meal_update=meal_update)
 
+@router_meals.patch("/{meal_id}", response_model=Meal)
+def patch_meal_endpoint(meal_id: int, meal_patch: MealPatch, db: Session = Depends(get_db)):
+    """
+    Partially update meal details, only the supplied fields are changed.
+    
+    :param meal_id: Meal ID.
+    :type meal_id: int
+    :param meal_patch: Fields to change.
+    :type meal_patch: MealPatch
+    :param db: Database session.
+    :type db: Session
+    :raises HTTPException: If meal is not found.
+    :return: Updated meal object.
+    :rtype: Meal
+    """
+    meal = patch_meal(db=db, meal_id=meal_id, meal_patch=meal_patch)
+    if meal is None:
+        raise HTTPException(status_code=404, detail="Meal not found")
+    return meal
+
 @router_meals.delete("/{meal_id}")
 def delete_meal_endpoint(meal_id: int, db: Session = Depends(get_db), auth_result: str = Security(auth.verify)):
     """
@@ -211,7 +444,24 @@ def delete_meal_endpoint(meal_id: int, db: Session = Depends(get_db), auth_resul
     delete_meal_by_id(db=db, meal_id=meal_id)
     return {"message": "Meal deleted successfully!"}
 
-router_orders = APIRouter(prefix="/orders", tags=["orders"])
+@router_meals.delete("/")
+def delete_meals_by_date_range_endpoint(date_from: date, date_to: date, db: Session = Depends(get_db), auth_result: str = Security(auth.verify)):
+    """
+    Delete all meals dated within a range, together with their orders.
+    
+    :param date_from: First day of the range (inclusive).
+    :type date_from: date
+    :param date_to: Last day of the range (inclusive).
+    :type date_to: date
+    :param db: Database session.
+    :type db: Session
+    :return: Deletion confirmation message with the number of deleted meals.
+    :rtype: dict
+    """
+    deleted = delete_meals_by_date_range(db=db, date_from=date_from, date_to=date_to)
+    return {"message": "Meals deleted successfully!", "deleted": deleted}
+
+router_orders = APIRouter(prefix="/orders", tags=["orders"], route_class=DeadlineRoute)
 
 @router_orders.post("/", response_model=Order)
 def create_order_endpoint(order: OrderCreate, db: Session = Depends(get_db)):
@@ -228,18 +478,80 @@ def create_order_endpoint(order: OrderCreate, db: Session = Depends(get_db)):
     return create_order(db=db, order=order)
 
 @router_orders.get("/", response_model=List[Order])
-def get_all_orders_endpoint(db: Session = Depends(get_db)):
+def get_all_orders_endpoint(include_archive: bool = False, db: Session = Depends(get_db)):
     """
     Retrieve all orders
     
+    :param include_archive: Whether to include orders of closed school years.
+    :type include_archive: bool
     :param db: Database session.
     :type db: Session
     :return: List of all meals.
     :rtype: List[Meal]
     """
-    meals = get_all_orders(db=db)
+    meals = get_all_orders(db=db, include_archive=include_archive)
     return meals
 
+@router_orders.post("/archive")
+def archive_orders_endpoint(before: Optional[date] = None, db: Session = Depends(get_db), auth_result: str = Security(auth.verify)):
+    """
+    Move orders of closed school years to the archive table.
+
+    :param before: Orders for meals dated before this day are archived. Defaults to the start of the current school year.
+    :type before: date | None
+    :param db: Database session.
+    :type db: Session
+    :return: Number of archived orders.
+    :rtype: dict
+    """
+    archived = archive_orders(db=db, before=before)
+    return {"archived": archived}
+
+@router_orders.post("/bulk/cancel")
+def cancel_orders_endpoint(bulk: OrderBulkFilter, db: Session = Depends(get_db), auth_result: str = Security(auth.verify)) -> Dict[str, int]:
+    """
+    Cancel all active, not yet withdrawn orders matching the filters in one statement.
+
+    :param bulk: Filters selecting the orders, e.g. a date and the user numbers of a class.
+    :type bulk: OrderBulkFilter
+    :param db: Database session.
+    :type db: Session
+    :return: Number of cancelled orders.
+    :rtype: Dict[str, int]
+
+    Example:
+        POST /orders/bulk/cancel {"date": "2025-03-14", "user_numbers": [1023, 1024]}
+    """
+    return {"cancelled": cancel_orders(db=db, bulk=bulk)}
+
+@router_orders.post("/bulk/withdraw")
+def withdraw_orders_endpoint(bulk: OrderBulkFilter, db: Session = Depends(get_db), auth_result: str = Security(auth.verify)) -> Dict[str, int]:
+    """
+    Mark all active, not yet withdrawn orders matching the filters as withdrawn in one statement.
+
+    :param bulk: Filters selecting the orders.
+    :type bulk: OrderBulkFilter
+    :param db: Database session.
+    :type db: Session
+    :return: Number of withdrawn orders.
+    :rtype: Dict[str, int]
+    """
+    return {"withdrawn": withdraw_orders(db=db, bulk=bulk)}
+
+@router_orders.post("/bulk/delete")
+def delete_orders_endpoint(bulk: OrderBulkFilter, db: Session = Depends(get_db), auth_result: str = Security(auth.verify)) -> Dict[str, int]:
+    """
+    Delete all orders matching the filters in one statement.
+
+    :param bulk: Filters selecting the orders.
+    :type bulk: OrderBulkFilter
+    :param db: Database session.
+    :type db: Session
+    :return: Number of deleted orders.
+    :rtype: Dict[str, int]
+    """
+    return {"deleted": delete_orders(db=db, bulk=bulk)}
+
 @router_orders.get("/{order_id}", response_model=Order)
 def get_order_endpoint(order_id: int, db: Session = Depends(get_db)):
     """
@@ -279,6 +591,29 @@ def update_order_endpoint(user_number: int, order_update: OrderUpdate, db: Sessi
     """
     return update_order(db=db, user_number=user_number, order_update=order_update)
 
+@router_orders.patch("/{user_number}", response_model=Order)
+def patch_order_endpoint(user_number: int, order_patch: OrderPatch, db: Session = Depends(get_db)):
+    """
+    Partially update the most recent order of a user, only the supplied fields are changed.
+
+    :param user_number: Unique user number.
+    :type user_number: int
+    :param order_patch: Fields to change.
+    :type order_patch: OrderPatch
+    :param db: Database session dependency.
+    :type db: Session
+    :raises HTTPException: If the user has no order.
+    :return: The updated order object.
+    :rtype: Order
+
+    Example:
+        PATCH /orders/1023 {"status": false, "withdrawed_at": "2025-01-01T12:00:00"}
+    """
+    order = patch_order(db=db, user_number=user_number, order_patch=order_patch)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
+
 
 @router_orders.delete("/{order_id}")
 def delete_order_endpoint(order_id: int, db: Session = Depends(get_db)):
@@ -295,3 +630,52 @@ def delete_order_endpoint(order_id: int, db: Session = Depends(get_db)):
     delete_order(db=db, order_id=order_id)
     return {"message": "Order deleted successfully!"}
 
+router_admin = APIRouter(prefix="/admin", tags=["admin"], route_class=DeadlineRoute)
+
+@router_admin.get("/profiles")
+def get_profiles_endpoint(auth_result: str = Security(auth.verify)) -> List[Dict[str, Any]]:
+    """
+    List captured request profiles, newest first.
+
+    :return: Summaries of the stored profiles.
+    :rtype: List[Dict[str, Any]]
+    """
+    return profile_store.list()
+
+@router_admin.get("/profiles/{profile_id}")
+def get_profile_endpoint(profile_id: int, limit: int = Query(50, ge=1, le=1000), auth_result: str = Security(auth.verify)) -> Dict[str, Any]:
+    """
+    Retrieve a captured request profile.
+
+    :param profile_id: Profile ID.
+    :type profile_id: int
+    :param limit: Maximum number of functions and folded stacks returned.
+    :type limit: int
+    :raises HTTPException: If the profile is not found.
+    :return: Per-function sample counts and the heaviest folded stacks.
+    :rtype: Dict[str, Any]
+    """
+    profile = profile_store.get(profile_id, limit=limit)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@router_admin.get("/statement-cache")
+def get_statement_cache_endpoint(auth_result: str = Security(auth.verify)) -> Dict[str, float]:
+    """
+    Retrieve compiled statement cache statistics.
+
+    :return: Number of executions per cache outcome and the hit ratio.
+    :rtype: Dict[str, float]
+    """
+    return get_cache_stats()
+
+@router_admin.get("/deadlines")
+def get_deadlines_endpoint(auth_result: str = Security(auth.verify)) -> Dict[str, int]:
+    """
+    Retrieve how many requests timed out or were cancelled because the client disconnected.
+
+    :return: Timeout and cancellation counters.
+    :rtype: Dict[str, int]
+    """
+    return get_deadline_stats()
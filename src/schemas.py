@@ -1,5 +1,5 @@
-from typing import Optional
-from pydantic import BaseModel, ValidationError, AfterValidator
+from typing import ClassVar, FrozenSet, List, Optional
+from pydantic import BaseModel, ValidationError, AfterValidator, Field, model_validator
 import datetime
 from typing_extensions import Annotated
 
@@ -17,6 +17,20 @@ def CheckMealValue(v: int) -> int:
         raise ValueError("value must be between or containing 1-3")
     return v
 
+def DeduplicateIds(v: List[str]) -> List[str]:
+    """
+    Remove repeated ids, keeping the order of their first occurrence.
+
+    :param v: List of ids to deduplicate.
+    :type v: List[str]
+    :return: The ids without repetitions.
+    :rtype: List[str]
+    """
+    return list(dict.fromkeys(v))
+
+# Most ISIC ids looked up by one batch request, bounds the size of its IN (...) query
+MAX_BATCH_IDS = 500
+
 class UserBase(BaseModel):
     """
     Base schema for user data.
@@ -39,6 +53,35 @@ class UserUpdate(UserBase):
     """
     pass
 
+class PatchBase(BaseModel):
+    """
+    Base schema for partial updates, omitted fields are left unchanged.
+
+    An explicit ``null`` is only accepted for the fields in ``nullable``, so a PATCH
+    can never write NULL into a column that must have a value.
+    """
+    nullable: ClassVar[FrozenSet[str]] = frozenset()
+
+    @model_validator(mode="after")
+    def check_nulls(self) -> "PatchBase":
+        nulls = sorted(
+            field for field in self.model_fields_set
+            if getattr(self, field) is None and field not in self.nullable
+        )
+        if nulls:
+            raise ValueError(f"fields must not be null: {', '.join(nulls)}")
+        return self
+
+class UserPatch(PatchBase):
+    """
+    Schema for partially updating a user, only supplied fields are changed.
+    """
+    name: Optional[str] = None
+    surname: Optional[str] = None
+    ISIC_id: Optional[str] = None
+    user_number: Optional[int] = None
+    password: Optional[str] = None
+
 class User(UserBase):
     """
     Schema for user retrieval including an ID.
@@ -48,6 +91,20 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class UserSearchResult(BaseModel):
+    """
+    Schema for a user found by the name search, without the password.
+    """
+    id: int
+    name: str
+    surname: str
+    user_number: int
+    ISIC_id: str
+    score: float
+
+    class Config:
+        from_attributes = True
+
 class MealBase(BaseModel):
     """
     Base schema for meal data.
@@ -55,6 +112,7 @@ class MealBase(BaseModel):
     meal_number: Annotated[int, AfterValidator(CheckMealValue)]
     name: str
     date: datetime.date
+    portions: Optional[int] = Field(default=None, ge=0)
 
 class MealCreate(MealBase):
     """
@@ -68,6 +126,18 @@ class MealUpdate(MealBase):
     """
     pass
 
+class MealPatch(PatchBase):
+    """
+    Schema for partially updating a meal, only supplied fields are changed.
+
+    ``portions`` may be null, which removes the capacity limit.
+    """
+    nullable: ClassVar[FrozenSet[str]] = frozenset({"portions"})
+    meal_number: Optional[Annotated[int, AfterValidator(CheckMealValue)]] = None
+    name: Optional[str] = None
+    date: Optional[datetime.date] = None
+    portions: Optional[int] = Field(default=None, ge=0)
+
 class Meal(MealBase):
     """
     Schema for meal retrieval including an ID.
@@ -100,6 +170,18 @@ class OrderUpdate(OrderBase):
     """
     pass
 
+class OrderPatch(PatchBase):
+    """
+    Schema for partially updating an order, only supplied fields are changed.
+
+    ``withdrawed_at`` may be null, which marks the order as not withdrawn.
+    """
+    nullable: ClassVar[FrozenSet[str]] = frozenset({"withdrawed_at"})
+    user_id: Optional[int] = None
+    meal_id: Optional[int] = None
+    status: Optional[bool] = None
+    withdrawed_at: Optional[datetime.datetime] = None
+
 class Order(OrderBase):
     """
     Schema for order retrieval including an ID.
@@ -108,3 +190,53 @@ class Order(OrderBase):
 
     class Config:
         from_attributes = True
+
+class UserOrder(BaseModel):
+    """
+    Schema for one order in a user's order history, with its meal.
+    """
+    order_id: int
+    meal_id: int
+    meal_number: int
+    meal_name: Optional[str] = None
+    meal_date: datetime.date
+    status: Optional[bool] = None
+    withdrawed_at: Optional[datetime.datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class UserOrdersPage(BaseModel):
+    """
+    Schema for one page of a user's order history, newest first.
+
+    ``next_cursor`` is passed back as ``cursor`` to get the next page, None on the last page.
+    """
+    items: List[UserOrder]
+    next_cursor: Optional[str] = None
+
+class MealInfoBatch(BaseModel):
+    """
+    Schema for looking up today's meal info for many ISIC ids at once, repeated ids are dropped.
+    """
+    ISIC_ids: Annotated[List[str], Field(min_length=1, max_length=MAX_BATCH_IDS), AfterValidator(DeduplicateIds)]
+
+class OrderBulkFilter(BaseModel):
+    """
+    Schema selecting the orders of a bulk operation, all supplied filters must match.
+
+    At least one filter is required, so a bulk operation never touches every order by accident.
+    A meal number names a meal of some day, so it needs a date (or a meal id) too.
+    """
+    date: Optional[datetime.date] = None
+    meal_number: Optional[Annotated[int, AfterValidator(CheckMealValue)]] = None
+    meal_id: Optional[int] = None
+    user_numbers: Optional[List[int]] = None
+
+    @model_validator(mode="after")
+    def check_not_empty(self) -> "OrderBulkFilter":
+        if not self.model_dump(exclude_none=True):
+            raise ValueError("at least one of date, meal_number, meal_id or user_numbers is required")
+        if self.meal_number is not None and self.date is None and self.meal_id is None:
+            raise ValueError("meal_number requires a date")
+        return self
@@ -0,0 +1,115 @@
+"""
+Diacritic-insensitive prefix and fuzzy search of users by name and surname.
+
+On Postgres the search runs on a trigram GIN index over the unaccented,
+lower-cased full name, so both prefix (``LIKE 'nov%'``) and fuzzy
+(``word_similarity``) matching are index scans. The extensions, the immutable
+``f_unaccent`` wrapper and the index are created by the deployment SQL
+(``Database_Deployment``), not by the application, since creating extensions needs
+privileges the application role should not have. Databases deployed without it,
+e.g. a new tenant, are provisioned once with::
+
+    python search.py --tenant gymnazium
+
+Other databases fall back to an unindexed case-insensitive substring match, meant
+only for local development. The fallback is NOT diacritic-insensitive: ``novak``
+does not find ``Novák`` there.
+"""
+import argparse
+from sqlalchemy import func, literal, literal_column, or_, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+from db.database import engine as default_engine, tenant_engines
+from db.models import User
+
+SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public",
+    "CREATE EXTENSION IF NOT EXISTS unaccent SCHEMA public",
+    # unaccent() is only STABLE, an index expression needs an IMMUTABLE function
+    """CREATE OR REPLACE FUNCTION public.f_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$""",
+    """CREATE INDEX IF NOT EXISTS ix_users_search_trgm ON users
+        USING gin (public.f_unaccent(lower(name || ' ' || surname)) public.gin_trgm_ops)""",
+]
+
+
+def ensure_search_index(engine: Engine) -> None:
+    """
+    Creates the objects the user search needs, on Postgres only.
+
+    Run once per database by the command line below or a benchmark, never at
+    application startup.
+
+    :param engine: The engine of the database.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        for statement in SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_statement(dialect: str, query: str, limit: int) -> Select:
+    """
+    Builds the ranked search query.
+
+    Prefix matches of the full name or of any word in it rank first, then matches
+    by trigram word similarity, best first.
+
+    :param dialect: Name of the database dialect.
+    :param query: Search text as typed by the user.
+    :param limit: Maximum number of results.
+    :return: Select returning users' ``id``, ``name``, ``surname``, ``user_number``, ``ISIC_id`` and ``score``.
+    """
+    query = " ".join(query.lower().split())
+    columns = (User.id, User.name, User.surname, User.user_number, User.ISIC_id)
+
+    if dialect != "postgresql":
+        document = func.lower(User.name + literal_column("' '") + User.surname)
+        return (
+            select(*columns, literal(1.0).label("score"))
+            .where(document.like(f"%{_escape_like(query)}%", escape="\\"))
+            .order_by(User.surname, User.name)
+            .limit(limit)
+        )
+
+    # Must be the exact expression of ix_users_search_trgm, otherwise the index is not used
+    document = func.public.f_unaccent(func.lower(User.name + literal_column("' '") + User.surname))
+    term = func.public.f_unaccent(literal(query))
+    prefix = _escape_like(query) + "%"
+    is_prefix = or_(
+        document.like(func.public.f_unaccent(literal(prefix)), escape="\\"),
+        document.like(func.public.f_unaccent(literal("% " + prefix)), escape="\\")
+    )
+    score = func.public.word_similarity(term, document)
+    return (
+        select(*columns, score.label("score"))
+        .where(or_(is_prefix, term.op("<%")(document)))
+        .order_by(is_prefix.desc(), score.desc(), User.surname, User.name)
+        .limit(limit)
+    )
+
+
+def main() -> None:
+    """
+    Parse command line arguments and create the search index in a tenant database.
+    """
+    parser = argparse.ArgumentParser(description="Create the user search index.")
+    parser.add_argument(
+        "--tenant",
+        default=None,
+        help="Tenant whose database is provisioned. Defaults to the default database."
+    )
+    args = parser.parse_args()
+
+    engine = tenant_engines.get_engine(args.tenant) if args.tenant else default_engine
+    ensure_search_index(engine)
+    print(f"Search index ready ({engine.dialect.name}).")
+
+if __name__ == '__main__':
+    main()
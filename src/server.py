@@ -0,0 +1,43 @@
+"""
+Production server entry point.
+
+Runs the application with uvicorn configured from ``Settings``: worker processes,
+event loop and HTTP parser (uvloop/httptools when installed), listen backlog,
+keep-alive and concurrency limits. On SIGTERM each worker stops accepting
+connections, finishes in-flight requests within ``server_graceful_timeout`` and
+closes its database pool. Each worker sizes its pool from the shared connection
+budget, see :func:`db.database.pool_size_per_worker`::
+
+    SERVER_HOST=0.0.0.0 SERVER_WORKERS=4 DB_MAX_CONNECTIONS=40 DB_ECHO=false python server.py
+"""
+import os
+import uvicorn
+from config import get_settings
+
+def main() -> None:
+    """
+    Start the server with the configured options.
+    """
+    settings = get_settings()
+    workers = settings.server_workers if settings.server_workers > 0 else os.cpu_count() or 1
+
+    # Worker processes read the settings again, let them size pools for the real worker count
+    os.environ["SERVER_WORKERS"] = str(workers)
+
+    uvicorn.run(
+        "main:app",
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=workers,
+        loop=settings.server_loop,
+        http=settings.server_http,
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keep_alive,
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+        limit_concurrency=settings.server_limit_concurrency,
+        access_log=False,
+        proxy_headers=True,
+    )
+
+if __name__ == '__main__':
+    main()
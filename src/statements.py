@@ -0,0 +1,156 @@
+"""
+Prebuilt, parameterized statements for the hot crud queries.
+
+The statements are constructed once at import time with ``bindparam`` placeholders,
+so a request only supplies parameter values instead of rebuilding the
+``select(...).where(...)`` expression. SQLAlchemy then finds the compiled form in
+the engine's compiled cache; :func:`instrument_engine` counts how often that
+lookup hits so the cache behaviour can be watched through ``/admin/statement-cache``.
+"""
+import threading
+from collections import Counter
+from typing import Dict
+from sqlalchemy import bindparam, event, select, tuple_, union_all, update
+from sqlalchemy.engine import Engine
+from db.models import User, Meal, Order, OrderArchive
+
+USER_BY_NUMBER = select(User).where(User.user_number == bindparam("user_number"))
+
+USER_BY_ISIC = select(User).where(User.ISIC_id == bindparam("isic_id"))
+
+USER_BY_NAME = select(User).where(
+    User.name == bindparam("name"),
+    User.surname == bindparam("surname")
+)
+
+MEAL_BY_ID = select(Meal).where(Meal.id == bindparam("meal_id"))
+
+MEAL_BY_NUMBER_AND_DATE = select(Meal).where(
+    Meal.meal_number == bindparam("meal_number"),
+    Meal.date == bindparam("date")
+)
+
+ORDER_BY_ID = select(Order).where(Order.id == bindparam("order_id"))
+
+# Most recent order of a user, found by student number
+LATEST_ORDER_ID_BY_USER = (
+    select(Order.id)
+    .join(User, Order.user_id == User.id)
+    .where(User.user_number == bindparam("user_number"))
+    .order_by(Order.id.desc())
+    .limit(1)
+    .scalar_subquery()
+)
+
+LATEST_ORDER_BY_USER = select(Order).where(Order.id == LATEST_ORDER_ID_BY_USER)
+
+# Locks the order whose status changes until its portion is reserved or released
+LOCK_LATEST_ORDER_BY_USER = LATEST_ORDER_BY_USER.with_for_update()
+
+# Values are supplied per call with .values(), the changed columns differ between patches
+UPDATE_LATEST_ORDER_BY_USER = (
+    update(Order)
+    .where(Order.id == LATEST_ORDER_ID_BY_USER)
+    .returning(Order)
+    .execution_options(synchronize_session=False)
+)
+
+UPDATE_ORDER_BY_ID = (
+    update(Order)
+    .where(Order.id == bindparam("order_id"))
+    .returning(Order)
+    .execution_options(synchronize_session=False)
+)
+
+USER_MEAL_INFO = (
+    select(
+        Meal.id.label("meal_id"),
+        User.id.label("user_id"),
+        Order.status.label("order_status"),
+        User.name.label("user_name"),
+        Meal.meal_number.label("meal_number"),
+        Meal.name.label("meal_name"),
+        User.user_number.label("user_number"),
+        Meal.date.label("meal_date")
+    )
+    .join(Order, Order.user_id == User.id)
+    .join(Meal, Order.meal_id == Meal.id)
+    .where(Order.user_id == bindparam("user_id"), Meal.date == bindparam("date"))
+    .limit(1)
+)
+
+def _user_orders(orders):
+    """Orders of one user from `orders` (``Order`` or ``OrderArchive``) with their meals."""
+    return (
+        select(
+            orders.id.label("order_id"),
+            orders.status,
+            orders.withdrawed_at,
+            Meal.id.label("meal_id"),
+            Meal.meal_number,
+            Meal.name.label("meal_name"),
+            Meal.date.label("meal_date")
+        )
+        .join(Meal, orders.meal_id == Meal.id)
+        .where(orders.user_id == bindparam("user_id"))
+    )
+
+
+def _after_cursor(orders):
+    """Keyset condition of the rows after the (meal_date, order_id) cursor."""
+    return tuple_(Meal.date, orders.id) < tuple_(bindparam("cursor_date"), bindparam("cursor_id"))
+
+
+USER_ORDERS = _user_orders(Order).order_by(Meal.date.desc(), Order.id.desc()).limit(bindparam("limit"))
+
+# Next page of USER_ORDERS after the (meal_date, order_id) cursor
+USER_ORDERS_AFTER = USER_ORDERS.where(_after_cursor(Order))
+
+
+def _user_order_history(after_cursor: bool):
+    # Archived orders keep their ids, so (meal_date, order_id) stays unique across both tables
+    branches = [
+        _user_orders(orders).where(_after_cursor(orders)) if after_cursor else _user_orders(orders)
+        for orders in (Order, OrderArchive)
+    ]
+    history = union_all(*branches).subquery("history")
+    return (
+        select(history)
+        .order_by(history.c.meal_date.desc(), history.c.order_id.desc())
+        .limit(bindparam("limit"))
+    )
+
+
+# USER_ORDERS and USER_ORDERS_AFTER including the orders_archive table
+USER_ORDER_HISTORY = _user_order_history(False)
+USER_ORDER_HISTORY_AFTER = _user_order_history(True)
+
+_cache_stats: Counter = Counter()
+_lock = threading.Lock()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Registers an engine event listener counting compiled cache hits and misses.
+
+    :param engine: The engine to instrument.
+    """
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _count_cache_hit(conn, cursor, statement, parameters, context, executemany):
+        with _lock:
+            _cache_stats[context.cache_hit.name.lower()] += 1
+
+
+def get_cache_stats() -> Dict[str, float]:
+    """
+    Returns compiled cache statistics of the instrumented engines.
+
+    :return: Number of executions per cache outcome (``cache_hit``, ``cache_miss``,
+        ``caching_disabled``, ``no_cache_key``) and the hit ratio.
+    """
+    with _lock:
+        stats = dict(_cache_stats)
+    cached = stats.get("cache_hit", 0) + stats.get("cache_miss", 0)
+    stats["hit_ratio"] = stats.get("cache_hit", 0) / cached if cached else 0.0
+    return stats
@@ -0,0 +1,278 @@
+"""
+Distributed-tracing-style spans for requests.
+
+Every request handled by a router using :class:`TracedRoute` gets a root span,
+crud functions decorated with :func:`traced` and token verification get child
+spans, and every SQL statement run on an instrumented engine gets a span with
+its duration. The current span is kept in a context variable, which FastAPI
+copies into the threadpool running sync endpoints, so nesting works across the
+event loop and worker threads.
+
+Finished spans are handed to a pluggable exporter chosen by
+``Settings.tracing_exporter``. When no exporter is configured, spans are not
+created at all.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import get_settings
+
+
+class Span:
+    """A timed unit of work within a trace."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[Dict[str, Any]] = None):
+        """
+        Initializes and starts a Span.
+
+        :param name: Name of the operation.
+        :param parent: Enclosing span, None for the root span of a trace.
+        :param attributes: Additional key-value data describing the operation.
+        """
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.error: Optional[str] = None
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self._token: Optional[contextvars.Token] = None
+
+    def finish(self) -> None:
+        """Ends the span and records its duration."""
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Serializes the span.
+
+        :return: JSON-compatible representation of the span.
+        """
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class InMemoryExporter:
+    """Keeps finished spans in a list, used in tests and for local inspection."""
+
+    def __init__(self):
+        """Initializes InMemoryExporter with no spans."""
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        """
+        Stores a finished span.
+
+        :param span: The finished span.
+        """
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self) -> None:
+        """Drops all stored spans."""
+        with self._lock:
+            self.spans.clear()
+
+
+class FileExporter:
+    """Appends finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path: str):
+        """
+        Initializes FileExporter.
+
+        :param path: Path of the file spans are appended to.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        """
+        Writes a finished span to the file.
+
+        :param span: The finished span.
+        """
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+_exporter = None
+
+
+def set_exporter(exporter) -> None:
+    """
+    Sets the exporter receiving finished spans.
+
+    Any object with an ``export(span)`` method can be used. Passing None disables tracing.
+
+    :param exporter: The exporter, or None.
+    """
+    global _exporter
+    _exporter = exporter
+
+
+def get_exporter():
+    """
+    Returns the exporter receiving finished spans.
+
+    :return: The configured exporter, or None when tracing is disabled.
+    """
+    return _exporter
+
+
+def configure_from_settings() -> None:
+    """Sets the exporter according to ``Settings.tracing_exporter``."""
+    settings = get_settings()
+    if settings.tracing_exporter == "memory":
+        set_exporter(InMemoryExporter())
+    elif settings.tracing_exporter == "file":
+        set_exporter(FileExporter(settings.tracing_file))
+    elif settings.tracing_exporter:
+        raise ValueError(f"Unknown tracing exporter '{settings.tracing_exporter}'.")
+
+
+def start_span(name: str, **attributes) -> Optional[Span]:
+    """
+    Starts a span as a child of the current one and makes it current.
+
+    Must be paired with :func:`end_span`; prefer :func:`span` where a ``with`` block fits.
+
+    :param name: Name of the operation.
+    :param attributes: Additional key-value data describing the operation.
+    :return: The started span, or None when tracing is disabled.
+    """
+    if _exporter is None:
+        return None
+    new_span = Span(name, _current_span.get(), attributes)
+    new_span._token = _current_span.set(new_span)
+    return new_span
+
+
+def end_span(finished: Optional[Span], error: Optional[BaseException] = None) -> None:
+    """
+    Ends a span started by :func:`start_span` and exports it.
+
+    :param finished: The span returned by :func:`start_span`.
+    :param error: Exception that ended the operation, if any.
+    """
+    if finished is None:
+        return
+    finished.finish()
+    if error is not None:
+        finished.error = repr(error)
+    _current_span.reset(finished._token)
+    if _exporter is not None:
+        _exporter.export(finished)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Context manager tracing the enclosed block as a child of the current span.
+
+    :param name: Name of the operation.
+    :param attributes: Additional key-value data describing the operation.
+    :yield: The started span, or None when tracing is disabled.
+
+    Example:
+        >>> with span("auth.verify_token"):
+        ...     verify()
+    """
+    current = start_span(name, **attributes)
+    try:
+        yield current
+    except BaseException as error:
+        end_span(current, error)
+        raise
+    else:
+        end_span(current)
+
+
+def traced(func: Callable) -> Callable:
+    """
+    Decorator tracing every call of a function as a span named ``<module>.<function>``.
+
+    :param func: The function to trace.
+    :return: The wrapped function.
+    """
+    name = f"{func.__module__}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _exporter is None:
+            return func(*args, **kwargs)
+        with span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class TracedRoute(APIRoute):
+    """APIRoute opening a root span for every request it handles."""
+
+    def get_route_handler(self) -> Callable:
+        """
+        Wraps the default route handler in a span named after the route.
+
+        :return: The wrapped route handler.
+        """
+        handler = super().get_route_handler()
+        methods = ",".join(sorted(self.methods))
+        name = f"{methods} {self.path_format}"
+
+        async def traced_handler(request):
+            if _exporter is None:
+                return await handler(request)
+            with span(name, path=request.url.path) as root:
+                response = await handler(request)
+                root.attributes["status_code"] = response.status_code
+                return response
+
+        return traced_handler
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Registers engine event listeners tracing every SQL statement.
+
+    :param engine: The engine to instrument.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _exporter is not None and _current_span.get() is not None:
+            context._trace_span = start_span("sql", statement=statement)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        end_span(getattr(context, "_trace_span", None))
+        context._trace_span = None
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        context = exception_context.execution_context
+        if context is not None:
+            end_span(getattr(context, "_trace_span", None), exception_context.original_exception)
+            context._trace_span = None
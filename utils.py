@@ -1,8 +1,9 @@
 from typing import Optional
 import jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import SecurityScopes, HTTPAuthorizationCredentials, HTTPBearer
 from config import get_settings
+from tracing import span
 
 
 class UnauthorizedException(HTTPException):
@@ -29,6 +30,45 @@ class UnauthenticatedException(HTTPException):
         )
 
 
+def resolve_tenant(request: Request) -> Optional[str]:
+    """
+    Resolves the tenant (canteen) a request is for.
+
+    A request with a bearer token is routed by the token's tenant claim only, so a
+    valid token can't be pointed at another canteen's database; the tenant header is
+    only accepted on requests without a token (e.g. scanner terminals). The claim is
+    read without verifying the token; it only selects the database, access control is
+    still done by :class:`VerifyToken` on protected endpoints.
+
+    :param request: The incoming request.
+    :return: Tenant name, or None when the request names no tenant.
+    :raises HTTPException: 400 if the token's tenant claim is not a string,
+        403 if a request with a token but no tenant claim names a tenant by header,
+        404 if the tenant has no configured database.
+    """
+    config = get_settings()
+
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        try:
+            claims = jwt.decode(credentials, options={"verify_signature": False})
+        except jwt.exceptions.DecodeError:
+            claims = {}
+        tenant = claims.get(config.tenant_claim) if isinstance(claims, dict) else None
+        if tenant is not None and not isinstance(tenant, str):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid tenant claim")
+        if not tenant and request.headers.get(config.tenant_header):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="The token has no tenant claim")
+    else:
+        tenant = request.headers.get(config.tenant_header)
+
+    if not tenant:
+        return None
+    if tenant not in config.tenant_databases:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown tenant '{tenant}'")
+    return tenant
+
+
 class VerifyToken:
     """Class responsible for verifying JWT tokens using PyJWT and JWKS."""
 
@@ -58,24 +98,25 @@ class VerifyToken:
         if token is None:
             raise UnauthenticatedException()
 
-        try:
-            signing_key = self.jwks_client.get_signing_key_from_jwt(
-                token.credentials
-            ).key
-        except jwt.exceptions.PyJWKClientError as error:
-            raise UnauthorizedException(str(error))
-        except jwt.exceptions.DecodeError as error:
-            raise UnauthorizedException(str(error))
-
-        try:
-            payload = jwt.decode(
-                token.credentials,
-                signing_key,
-                algorithms=self.config.auth0_algorithms,
-                audience=self.config.auth0_api_audience,
-                issuer=self.config.auth0_issuer,
-            )
-        except Exception as error:
-            raise UnauthorizedException(str(error))
+        with span("auth.verify_token"):
+            try:
+                signing_key = self.jwks_client.get_signing_key_from_jwt(
+                    token.credentials
+                ).key
+            except jwt.exceptions.PyJWKClientError as error:
+                raise UnauthorizedException(str(error))
+            except jwt.exceptions.DecodeError as error:
+                raise UnauthorizedException(str(error))
+
+            try:
+                payload = jwt.decode(
+                    token.credentials,
+                    signing_key,
+                    algorithms=self.config.auth0_algorithms,
+                    audience=self.config.auth0_api_audience,
+                    issuer=self.config.auth0_issuer,
+                )
+            except Exception as error:
+                raise UnauthorizedException(str(error))
 
         return payload
\ No newline at end of file